@@ -1,21 +1,51 @@
 import sys
+import os
 import re
+import csv
+import math
 import time
+import zlib
+import heapq
+import json
+import mmap
+import random
+import stat
+import struct
+import argparse
+import tempfile
+import threading
 import traceback
-from datetime import datetime
+import subprocess
+import tracemalloc
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import permutations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+import numpy as np
 import requests
 import pytz
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QLineEdit, QPushButton, QTextEdit, QLabel, QSplitter, QStatusBar,
     QProgressBar, QFrame, QGridLayout, QTabWidget, QScrollArea,
-    QGroupBox, QComboBox, QCheckBox, QSpinBox
+    QGroupBox, QComboBox, QCheckBox, QSpinBox, QFileDialog
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer, QPropertyAnimation, QEasingCurve, QRect
-from PyQt6.QtGui import QFont, QPalette, QColor, QIcon, QPixmap, QPainter, QPen
+from PyQt6.QtCore import Qt, QObject, QThread, QEventLoop, pyqtSignal, QTimer, QPropertyAnimation, QEasingCurve, QRect
+from PyQt6.QtGui import QFont, QPalette, QColor, QIcon, QPixmap, QPainter, QPen, QTextCursor, QTextDocumentFragment
 from PyQt6.QtSvgWidgets import QSvgWidget
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet / Arrow 导出为可选功能
+    pa = pq = None
+
 
 # --- 样式表 --- 
 STYLESHEET = """
@@ -186,6 +216,51 @@ QFrame#separatorLine {
 }
 """
 
+# --- 结果要素图标 ---
+WEATHER_ICONS = {
+    '场站': '🛩️',
+    '观测时间': '🕐',
+    '风': '💨',
+    '能见度': '👁️',
+    '天气现象': '🌦️',
+    '云况': '☁️',
+    '温度/露点': '🌡️',
+    '气压': '📊',
+    '跑道视程': '🛬',
+    '趋势预报': '📈',
+    '近期天气': '🌧️',
+    '风切变': '💨',
+    '备注': '📝',
+    '飞行规则': '✈️',
+    '相对湿度': '💧',
+    '气压高度': '📏',
+    '密度高度': '🏔️',
+    '跑道风分量': '🧭',
+    '距离': '📍',
+    '24小时温度': '📈',
+    '24小时阵风': '🌬️',
+    '24小时气压变化': '📉',
+    'IFR持续': '⏳'
+}
+
+# --- 天气现象组 ---
+class WeatherGroup:
+    """解码后的天气现象组：强度 ('-' 弱, '+' 强, 'VC' 附近)、描述词、现象代码序列和中文描述。
+    standard 为 False 表示各部分都可识别，但组合不在有效组合表中"""
+    __slots__ = ('code', 'intensity', 'descriptor', 'phenomena', 'description', 'standard')
+
+    def __init__(self, code, intensity, descriptor, phenomena, description, standard=True):
+        self.code = code
+        self.intensity = intensity
+        self.descriptor = descriptor
+        self.phenomena = phenomena
+        self.description = description
+        self.standard = standard
+
+    def __repr__(self):
+        return f'WeatherGroup({self.code!r}, {self.description!r})'
+
+
 # --- METAR 解析器 --- 
 class METARParser:
     WEATHER_PHENOMENA = {
@@ -199,30 +274,97 @@ class METARParser:
         'VCTS': '附近雷暴', 'VCSH': '附近阵雨'
     }
 
+    WEATHER_GROUP_PATTERN = re.compile(
+        r'^(?P<intensity>[-+]|VC)?(?=[A-Z]{2})(?P<descriptor>MI|BC|PR|DR|BL|SH|TS|FZ)?'
+        r'(?P<phenomena>(?:DZ|RA|SN|SG|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PO|SQ|FC|SS|DS){0,3})$')
+    INTENSITY_NAMES = {'-': '弱', '+': '强', 'VC': '附近'}
+    PRECIPITATION = ('DZ', 'RA', 'SN', 'SG', 'PL', 'GR', 'GS', 'UP')
+    SHOWER_PRECIPITATION = ('RA', 'SN', 'PL', 'GR', 'GS', 'UP')
+    FREEZING_PRECIPITATION = ('DZ', 'RA', 'UP')
+    OBSCURATION = ('BR', 'FG', 'FU', 'VA', 'DU', 'SA', 'HZ')
+    OTHER_PHENOMENA = ('PO', 'SQ', 'FC', 'SS', 'DS')
+    WEATHER_TABLE = {}  # 代码 -> WeatherGroup，模块加载时由 build_weather_table 生成
+
     def translate_cloud_cover(self, code):
         return {
             'FEW': '少云 (1-2成)', 'SCT': '疏云 (3-4成)', 'BKN': '多云 (5-7成)',
             'OVC': '阴天 (8成)', 'NSC': '无重要云', 'NCD': '无云'
         }.get(code, code)
 
-    def translate_weather_phenomena(self, code):
-        code_to_parse = code.replace('+', '').replace('-', '').replace('VC', '')
-        desc = ''
-        i = 0
-        while i < len(code_to_parse):
-            if i + 4 <= len(code_to_parse) and code_to_parse[i:i+4] in self.WEATHER_PHENOMENA:
-                desc += self.WEATHER_PHENOMENA[code_to_parse[i:i+4]]
-                i += 4
-            elif i + 2 <= len(code_to_parse) and code_to_parse[i:i+2] in self.WEATHER_PHENOMENA:
-                desc += self.WEATHER_PHENOMENA[code_to_parse[i:i+2]]
-                i += 2
+    @classmethod
+    def describe_weather(cls, intensity, descriptor, phenomena):
+        """由各部分组合中文描述，描述词与第一个现象有合成译名 (如 TSRA 雷雨) 时优先使用"""
+        names = cls.WEATHER_PHENOMENA
+        if not phenomena and intensity + descriptor in names:
+            return names[intensity + descriptor]  # VCTS, VCSH
+        parts = []
+        remaining = phenomena
+        if descriptor:
+            if phenomena and descriptor + phenomena[0] in names:
+                parts.append(names[descriptor + phenomena[0]])
+                remaining = phenomena[1:]
             else:
-                i += 2
-        final_desc = desc.strip()
-        if code.startswith('+'): final_desc = '强 ' + final_desc
-        if code.startswith('-'): final_desc = '弱 ' + final_desc
-        if 'VC' in code: final_desc = '附近 ' + final_desc
-        return final_desc if final_desc else code
+                parts.append(names[descriptor])
+        parts.extend(names[code] for code in remaining)
+        description = ''.join(parts)
+        if intensity:
+            description = f'{cls.INTENSITY_NAMES[intensity]} {description}'
+        return description
+
+    @classmethod
+    def build_weather_table(cls):
+        """生成全部有效的 强度/描述词/现象 组合 (混合降水最多三种，主要降水在前)"""
+        combinations = [('', 'TS', ()), ('VC', 'TS', ()), ('VC', 'SH', ())]
+        for count in (1, 2, 3):
+            for mix in permutations(cls.PRECIPITATION, count):
+                for intensity in ('', '-', '+'):
+                    combinations.append((intensity, '', mix))
+                    combinations.append((intensity, 'TS', mix))
+                    if all(code in cls.SHOWER_PRECIPITATION for code in mix):
+                        combinations.append((intensity, 'SH', mix))
+                    if mix[0] in cls.FREEZING_PRECIPITATION:
+                        combinations.append((intensity, 'FZ', mix))
+        for code in cls.OBSCURATION + cls.OTHER_PHENOMENA:
+            combinations.append(('', '', (code,)))
+        for descriptor in ('MI', 'BC', 'PR', 'FZ'):
+            combinations.append(('', descriptor, ('FG',)))
+        for code in ('DU', 'SA', 'SN'):
+            combinations.extend([('', 'DR', (code,)), ('', 'BL', (code,)), ('VC', 'BL', (code,))])
+        for code in ('FC', 'SS', 'DS'):
+            combinations.append(('+', '', (code,)))
+        for code in ('FG', 'PO', 'FC', 'SS', 'DS', 'VA'):
+            combinations.append(('VC', '', (code,)))
+
+        table = {}
+        for intensity, descriptor, phenomena in combinations:
+            code = intensity + descriptor + ''.join(phenomena)
+            table[code] = WeatherGroup(code, intensity, descriptor, phenomena,
+                                       cls.describe_weather(intensity, descriptor, phenomena))
+        return table
+
+    @classmethod
+    def decode_weather(cls, code):
+        """解码一个天气现象组：先查有效组合表，未收录的组合按结构解析；不是天气现象组时返回 None"""
+        group = cls.WEATHER_TABLE.get(code)
+        if group is None:
+            group = cls.decode_nonstandard_weather(code)
+        return group
+
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def decode_nonstandard_weather(cls, code):
+        match = cls.WEATHER_GROUP_PATTERN.match(code)
+        if not match:
+            return None
+        phenomena = match.group('phenomena')
+        phenomena = tuple(phenomena[i:i + 2] for i in range(0, len(phenomena), 2))
+        intensity, descriptor = match.group('intensity') or '', match.group('descriptor') or ''
+        return WeatherGroup(code, intensity, descriptor, phenomena,
+                            cls.describe_weather(intensity, descriptor, phenomena), standard=False)
+
+    def translate_weather_phenomena(self, code):
+        group = self.decode_weather(code)
+        return group.description if group else code
 
     def parse_wind(self, wind_code, is_trend=False):
         unit_str = '米/秒' if 'MPS' in wind_code else '节'
@@ -286,13 +428,10 @@ class METARParser:
         if vis_match: parts['能见度'] = f'{vis_match.group(1)}米'
         elif 'CAVOK' in metar_line: parts['能见度'] = 'CAVOK (云和能见度都良好)'
 
-        # 天气现象 (改进正则，处理更复杂的情况)
-        weather_match = re.search(r' ((-|\+)?(VC)?(MI|BC|PR|DR|BL|SH|TS|FZ)?([A-Z]{2}){1,3}) ', metar_line)
-        if weather_match:
-            full_code = weather_match.group(1)
-            # 避免将云码错误识别为天气现象
-            if full_code not in ['FEW', 'SCT', 'BKN', 'OVC', 'NSC']:
-                parts['天气现象'] = f'{self.translate_weather_phenomena(full_code)} ({full_code})'
+        # 天气现象 (报文主体中的全部天气现象组)
+        weather = [self.decode_weather(code) for code in self.weather_groups(metar_line)]
+        if weather:
+            parts['天气现象'] = ', '.join(f'{group.description} ({group.code})' for group in weather)
 
         # 云
         cloud_matches = re.findall(r' (FEW|SCT|BKN|OVC|VV)(\d{3})(CB|TCU)?', metar_line)
@@ -343,10 +482,9 @@ class METARParser:
                 parts['趋势预报'] = '<br>'.join(full_trend_desc)
 
         # 近期天气
-        recent_weather_match = re.search(r' RE([A-Z]{2,8}) ', metar_line)
-        if recent_weather_match:
-            code = recent_weather_match.group(1)
-            parts['近期天气'] = f'{self.translate_weather_phenomena(code)} ({code})'
+        recent_codes = re.findall(r' RE([A-Z]{2,8})(?= |$)', metar_line.split(' RMK ')[0])
+        if recent_codes:
+            parts['近期天气'] = ', '.join(f'{self.translate_weather_phenomena(code)} ({code})' for code in recent_codes)
 
         # 风切变
         windshear_match = re.search(r' WS (ALL RWY|RWY(\d{2}[RLC]?))', metar_line)
@@ -398,18 +536,1573 @@ class METARParser:
             details.append(f'- 云: {", ".join(cloud_descs)}')
 
         # 天气
-        weather_codes = re.findall(r'(-|\+|VC)?([A-Z]{2,4})', remaining_content)
-        if weather_codes:
-            weather_descs = []
-            for code in weather_codes:
-                full_code = ''.join(filter(None, code))
-                if full_code not in ['BECMG', 'TEMPO', 'FM', 'TL', 'AT', 'KT', 'MPS', 'NSC'] and not full_code.isdigit():
-                    weather_descs.append(self.translate_weather_phenomena(full_code))
-            if weather_descs:
-                details.append(f'- 天气: {", ".join(weather_descs)}')
+        tokens = remaining_content.split()
+        weather_descs = [group.description for group in map(self.decode_weather, tokens) if group]
+        if 'NSW' in tokens:
+            weather_descs.append('无重要天气')
+        if weather_descs:
+            details.append(f'- 天气: {", ".join(weather_descs)}')
 
         return details
 
+    def weather_groups(self, metar_line):
+        """返回报文主体中的全部天气现象组代码"""
+        body = re.split(r' (?:NOSIG|BECMG|TEMPO|RMK)\b', metar_line, maxsplit=1)[0]
+        return [token for token in body.split()[1:] if self.decode_weather(token) is not None]
+
+    def observation_time(self, metar_line, reference=None):
+        """根据 DDHHMMZ 推算观测时间 (UTC)，日期大于参考日期时视为上个月"""
+        match = re.search(r' (\d{2})(\d{2})(\d{2})Z', metar_line)
+        if not match:
+            return None
+        reference = reference or datetime.now(pytz.utc)
+        day, hour, minute = (int(g) for g in match.groups())
+        year, month = reference.year, reference.month
+        if day > reference.day + 1:
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        try:
+            return datetime(year, month, day, hour, minute, tzinfo=pytz.utc)
+        except ValueError:
+            return None
+
+    def extract_fields(self, metar_line):
+        """提取报文主体中的数值要素 (风: 节, 能见度: 米, 云底高: 英尺, 温度: 摄氏度, 气压: 百帕)"""
+        fields = {
+            'wind_dir': math.nan, 'wind_speed': math.nan, 'wind_gust': math.nan,
+            'visibility': math.nan, 'ceiling': math.nan,
+            'temp': math.nan, 'dew': math.nan, 'qnh': math.nan,
+            'rvr': math.nan, 'runways': [],
+        }
+        # 只看主体部分，趋势和备注里的要素不参与计算
+        body = re.split(r' (?:NOSIG|BECMG|TEMPO|RMK)\b', metar_line, maxsplit=1)[0] + ' '
+
+        wind_match = re.search(r' (\d{3}|VRB)(\d{2,3})(?:G(\d{2,3}))?(KT|MPS) ', body)
+        if wind_match:
+            factor = 1.94384 if wind_match.group(4) == 'MPS' else 1.0
+            if wind_match.group(1) != 'VRB':
+                fields['wind_dir'] = float(wind_match.group(1))
+            fields['wind_speed'] = int(wind_match.group(2)) * factor
+            if wind_match.group(3):
+                fields['wind_gust'] = int(wind_match.group(3)) * factor
+
+        vis_match = re.search(r' (\d{4}) ', body)
+        sm_match = re.search(r' (?:(\d+) )?M?(\d+/\d+|\d+)SM ', body)
+        if vis_match:
+            vis = int(vis_match.group(1))
+            fields['visibility'] = 10000.0 if vis == 9999 else float(vis)
+        elif sm_match:
+            whole = int(sm_match.group(1)) if sm_match.group(1) else 0
+            numerator, _, denominator = sm_match.group(2).partition('/')
+            miles = whole + (int(numerator) / int(denominator) if denominator else int(numerator))
+            fields['visibility'] = miles * 1609.344
+        elif 'CAVOK' in body:
+            fields['visibility'] = 10000.0
+
+        ceilings = [int(h) * 100 for _, h in re.findall(r' (BKN|OVC|VV)(\d{3})', body)]
+        if ceilings:
+            fields['ceiling'] = float(min(ceilings))
+
+        temp_dew_match = re.search(r' (M?\d{2})/(M?\d{2})? ', body)
+        if temp_dew_match:
+            fields['temp'] = float(temp_dew_match.group(1).replace('M', '-'))
+            if temp_dew_match.group(2):
+                fields['dew'] = float(temp_dew_match.group(2).replace('M', '-'))
+
+        qnh_match = re.search(r' ([QA])(\d{4})', body)
+        if qnh_match:
+            value = int(qnh_match.group(2))
+            fields['qnh'] = float(value) if qnh_match.group(1) == 'Q' else value / 100 * 33.8639
+
+        for runway, rvr in re.findall(r' R(\d{2}[RLC]?)/[PM]?(\d{4})', body):
+            if math.isnan(fields['rvr']) or float(rvr) < fields['rvr']:
+                fields['rvr'] = float(rvr)
+            if runway not in fields['runways']:
+                fields['runways'].append(runway)
+
+        return fields
+
+
+METARParser.WEATHER_TABLE = METARParser.build_weather_table()
+
+
+# --- 站点坐标表 ---
+STATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stations.csv')
+
+@lru_cache(maxsize=None)
+def load_station_table(path=STATIONS_FILE):
+    """读取随程序附带的站点表，返回 {ICAO: (纬度, 经度, 标高英尺, 名称)}"""
+    table = {}
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                table[row['icao']] = (float(row['lat']), float(row['lon']),
+                                      float(row['elevation_ft']), row['name'])
+    except OSError:
+        pass
+    return table
+
+
+# --- 站点空间索引 ---
+class StationIndex:
+    """按经纬度网格分桶的站点空间索引，支持半径查询和最近邻查询"""
+    EARTH_RADIUS_KM = 6371.0088
+    CELL_DEG = 1.0
+    WITHIN_PATTERN = re.compile(r'^WITHIN\s+(\d+(?:\.\d+)?)\s*KM\s+OF\s+(.+)$')
+    NEAREST_PATTERN = re.compile(r'^NEAREST\s+(\d+)\s+TO\s+(.+)$')
+
+    def __init__(self, station_table, stations=None):
+        codes = [s for s in (station_table if stations is None else stations) if s in station_table]
+        self.codes = codes
+        lat = np.array([station_table[s][0] for s in codes], dtype=np.float64)
+        lon = np.array([station_table[s][1] for s in codes], dtype=np.float64)
+        self.lat = np.radians(lat)
+        self.lon = np.radians(lon)
+
+        # 网格: 行按纬度, 列按经度, 每格内的站点下标连续存放
+        self.rows = int(round(180 / self.CELL_DEG))
+        self.cols = int(round(360 / self.CELL_DEG))
+        row = np.clip(((lat + 90) // self.CELL_DEG).astype(np.intp), 0, self.rows - 1)
+        col = ((lon + 180) // self.CELL_DEG).astype(np.intp) % self.cols
+        keys = row * self.cols + col
+        self.order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[self.order]
+        unique, starts = np.unique(sorted_keys, return_index=True)
+        ends = np.append(starts[1:], len(sorted_keys))
+        self.cells = {int(k): (int(a), int(b)) for k, a, b in zip(unique, starts, ends)}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _candidates(self, lat, lon, radius_km):
+        """取出可能落在半径内的网格中的站点下标"""
+        radius_deg = math.degrees(radius_km / self.EARTH_RADIUS_KM)
+        row = min(int((lat + 90) // self.CELL_DEG), self.rows - 1)
+        span = int(math.ceil(radius_deg / self.CELL_DEG))
+        row_range = range(max(row - span, 0), min(row + span, self.rows - 1) + 1)
+
+        max_lat = min(abs(lat) + radius_deg, 90.0)
+        if max_lat >= 89.0:
+            col_range = range(self.cols)
+        else:
+            lon_span = int(math.ceil(radius_deg / math.cos(math.radians(max_lat)) / self.CELL_DEG))
+            col = int((lon + 180) // self.CELL_DEG) % self.cols
+            if 2 * lon_span + 1 >= self.cols:
+                col_range = range(self.cols)
+            else:
+                col_range = [(col + d) % self.cols for d in range(-lon_span, lon_span + 1)]
+
+        slices = [self.order[a:b] for r in row_range for c in col_range
+                  for a, b in (self.cells.get(r * self.cols + c, (0, 0)),) if b > a]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.intp)
+
+    def _distances(self, lat, lon, indices):
+        """haversine 大圆距离 (公里)"""
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        dlat = self.lat[indices] - lat1
+        dlon = self.lon[indices] - lon1
+        a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(self.lat[indices]) * np.sin(dlon / 2) ** 2
+        return 2 * self.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def within(self, lat, lon, radius_km):
+        """返回半径内的全部站点 [(ICAO, 距离公里)]，按距离排序"""
+        indices = self._candidates(lat, lon, radius_km)
+        distances = self._distances(lat, lon, indices)
+        keep = distances <= radius_km
+        indices, distances = indices[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return [(self.codes[indices[k]], float(distances[k])) for k in order]
+
+    def nearest(self, lat, lon, count):
+        """返回最近的 count 个站点 [(ICAO, 距离公里)]；逐步扩大搜索半径"""
+        radius = 50.0
+        half_circumference = math.pi * self.EARTH_RADIUS_KM
+        while True:
+            found = self.within(lat, lon, radius)
+            if len(found) >= count or radius >= half_circumference:
+                return found[:count]
+            radius = min(radius * 2, half_circumference)
+
+    @classmethod
+    def resolve_location(cls, text, station_table):
+        """把 ICAO 代码或 "纬度 经度" 转成坐标，无法识别时返回 None"""
+        text = text.strip()
+        if text in station_table:
+            return station_table[text][0], station_table[text][1]
+        parts = text.split()
+        if len(parts) == 2:
+            try:
+                lat, lon = float(parts[0]), float(parts[1])
+            except ValueError:
+                return None
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return lat, lon
+        return None
+
+    def query(self, token, station_table):
+        """执行查询框中的空间查询 (WITHIN 150KM OF ZSPD / NEAREST 5 TO 31.2 121.5)
+
+        不是空间查询时返回 None；位置无法识别时抛出 ValueError。
+        """
+        within_match = self.WITHIN_PATTERN.match(token)
+        nearest_match = self.NEAREST_PATTERN.match(token)
+        match = within_match or nearest_match
+        if not match:
+            return None
+        location = self.resolve_location(match.group(2), station_table)
+        if location is None:
+            raise ValueError(f"无法识别的位置: {match.group(2)}")
+        if within_match:
+            return self.within(*location, float(match.group(1)))
+        return self.nearest(*location, int(match.group(1)))
+
+
+# --- 派生参数 (NumPy 批量计算) ---
+class DerivedTable:
+    """每次下载后对全部站点一次性计算的派生参数：飞行规则、相对湿度、气压/密度高度、跑道风分量"""
+    CATEGORY_NAMES = ('', 'LIFR', 'IFR', 'MVFR', 'VFR')
+    FT_PER_HPA = 1000 / 33.8639
+    # 查询框中可过滤的列 -> 数组属性
+    COLUMNS = {
+        'CAT': 'category', 'RH': 'rh', 'PA': 'pressure_alt', 'DA': 'density_alt',
+        'XW': 'max_crosswind', 'HW': 'min_headwind',
+        'VIS': 'visibility', 'CIG': 'ceiling', 'TEMP': 'temp', 'DEW': 'dew',
+        'QNH': 'qnh', 'WIND': 'wind_speed', 'GUST': 'wind_gust', 'RVR': 'rvr',
+        # 24 小时滚动统计 (由 RollingStatistics 增量维护)
+        'TMIN': 'temp_min', 'TMAX': 'temp_max', 'TAVG': 'temp_mean',
+        'GMAX': 'gust_max', 'GAVG': 'gust_mean', 'QTRD': 'qnh_change', 'IFRH': 'ifr_hours',
+    }
+    OPERATORS = {
+        '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+        '=': np.equal, '!=': np.not_equal,
+    }
+    FILTER_PATTERN = re.compile(r'^([A-Z]+)\s*(<=|>=|!=|=|<|>)\s*([A-Z0-9.\-]+)$')
+    # 从报文解析出的基础列 (其余列都由它们计算)，共享缓存段按此顺序存放
+    BASE_COLUMNS = ('wind_dir', 'wind_speed', 'wind_gust', 'visibility', 'ceiling',
+                    'temp', 'dew', 'qnh', 'rvr', 'elevation')
+    ROLLING_COLUMNS = ('temp_min', 'temp_max', 'temp_mean', 'gust_min', 'gust_max', 'gust_mean',
+                       'qnh_min', 'qnh_max', 'qnh_mean', 'qnh_change', 'ifr_hours')
+
+    def __init__(self, stations, records, station_table):
+        n = len(stations)
+        columns = {key: np.fromiter((r[key] for r in records), dtype=np.float64, count=n)
+                   for key in self.BASE_COLUMNS if key != 'elevation'}
+        columns['elevation'] = np.fromiter(
+            (station_table[s][2] if s in station_table else math.nan for s in stations),
+            dtype=np.float64, count=n)
+
+        # 跑道按站点顺序展开成 (站点下标, 跑道) 对
+        rw_station = np.array([i for i, r in enumerate(records) for _ in r['runways']], dtype=np.intp)
+        rw_names = [rw for r in records for rw in r['runways']]
+        self._setup(stations, columns, rw_station, rw_names)
+
+    @classmethod
+    def from_columns(cls, stations, columns, rw_station, rw_names):
+        """由已解码的基础列直接构建 (共享缓存客户端使用，无需再解析报文)"""
+        table = cls.__new__(cls)
+        table._setup(stations, columns, rw_station, rw_names)
+        return table
+
+    def _setup(self, stations, columns, rw_station, rw_names):
+        self.stations = stations
+        self.index = {s: i for i, s in enumerate(stations)}
+        for key in self.BASE_COLUMNS:
+            setattr(self, key, columns[key])
+        self.rw_station = rw_station
+        self.rw_names = rw_names
+        self.rw_heading = np.array([int(rw[:2]) * 10 for rw in rw_names], dtype=np.float64)
+        for key in self.ROLLING_COLUMNS:
+            setattr(self, key, np.full(len(stations), np.nan))
+
+        with np.errstate(invalid='ignore', over='ignore'):
+            self._compute()
+
+    def attach_rolling(self, rolling):
+        """填入滚动统计列，统计本身由 RollingStatistics 增量维护，这里只按站点取值"""
+        for key, values in rolling.columns(self.stations).items():
+            setattr(self, key, values)
+
+    def _compute(self):
+        # 飞行规则 (FAA 标准: 云底高英尺 / 能见度英里)
+        vis_sm = self.visibility / 1609.344
+        cig = np.where(np.isnan(self.ceiling), np.inf, self.ceiling)
+        self.category = np.select(
+            [(cig < 500) | (vis_sm < 1), (cig < 1000) | (vis_sm < 3), (cig <= 3000) | (vis_sm <= 5)],
+            [1, 2, 3], default=4).astype(np.int8)
+        self.category[np.isnan(self.visibility)] = 0
+
+        # 相对湿度 (Magnus 公式)
+        a, b = 17.625, 243.04
+        self.rh = np.clip(100 * np.exp(a * self.dew / (b + self.dew) - a * self.temp / (b + self.temp)), 0, 100)
+
+        # 气压高度 / 密度高度 (需要场高，站点表中没有的站为 NaN)
+        self.pressure_alt = self.elevation + (1013.25 - self.qnh) * self.FT_PER_HPA
+        isa_temp = 15 - 1.98 * self.pressure_alt / 1000
+        self.density_alt = self.pressure_alt + 120 * (self.temp - isa_temp)
+
+        # 跑道风分量 (顶风为正, 侧风右侧来风为正; 风向不定时为 NaN)
+        angle = np.radians(self.wind_dir[self.rw_station] - self.rw_heading)
+        speed = self.wind_speed[self.rw_station]
+        self.rw_headwind = speed * np.cos(angle)
+        self.rw_crosswind = speed * np.sin(angle)
+        n = len(self.stations)
+        self.max_crosswind = np.full(n, np.nan)
+        self.min_headwind = np.full(n, np.nan)
+        np.fmax.at(self.max_crosswind, self.rw_station, np.abs(self.rw_crosswind))
+        np.fmin.at(self.min_headwind, self.rw_station, self.rw_headwind)
+
+    @classmethod
+    def compute(cls, metar_data, parser, station_table=None):
+        stations = list(metar_data.keys())
+        records = [parser.extract_fields(metar_data[s]) for s in stations]
+        return cls(stations, records, station_table or {})
+
+    def __len__(self):
+        return len(self.stations)
+
+    def rows(self, station):
+        """返回某站的派生参数结果行"""
+        i = self.index.get(station)
+        if i is None:
+            return {}
+        rows = {}
+        if self.category[i]:
+            rows['飞行规则'] = self.CATEGORY_NAMES[self.category[i]]
+        if not np.isnan(self.rh[i]):
+            rows['相对湿度'] = f'{self.rh[i]:.0f}%'
+        if not np.isnan(self.pressure_alt[i]):
+            rows['气压高度'] = f'{self.pressure_alt[i]:.0f} 英尺'
+        if not np.isnan(self.density_alt[i]):
+            rows['密度高度'] = f'{self.density_alt[i]:.0f} 英尺'
+
+        start, end = np.searchsorted(self.rw_station, [i, i + 1])
+        components = []
+        for k in range(start, end):
+            head, cross = self.rw_headwind[k], self.rw_crosswind[k]
+            if np.isnan(head):
+                continue
+            head_desc = f'顶风 {head:.0f}节' if head >= 0 else f'顺风 {-head:.0f}节'
+            side = '右' if cross > 0 else '左'
+            components.append(f'跑道 {self.rw_names[k]}: {head_desc}, 侧风 {abs(cross):.0f}节 ({side})')
+        if components:
+            rows['跑道风分量'] = '<br>'.join(components)
+
+        if not np.isnan(self.temp_mean[i]):
+            rows['24小时温度'] = (f'最低 {self.temp_min[i]:.0f}°C / 最高 {self.temp_max[i]:.0f}°C / '
+                                f'平均 {self.temp_mean[i]:.1f}°C')
+        if not np.isnan(self.gust_mean[i]):
+            rows['24小时阵风'] = (f'最小 {self.gust_min[i]:.0f}节 / 最大 {self.gust_max[i]:.0f}节 / '
+                                f'平均 {self.gust_mean[i]:.1f}节')
+        if not np.isnan(self.qnh_change[i]):
+            rows['24小时气压变化'] = (f'{self.qnh_change[i]:+.1f} hPa (最低 {self.qnh_min[i]:.0f} / '
+                                  f'最高 {self.qnh_max[i]:.0f} hPa)')
+        if self.category[i] in (1, 2) and not np.isnan(self.ifr_hours[i]):
+            hours, minutes = divmod(round(self.ifr_hours[i] * 60), 60)
+            rows['IFR持续'] = f'{hours} 小时 {minutes} 分'
+        return rows
+
+    @classmethod
+    def parse_filter(cls, token):
+        """解析查询框中的过滤条件 (如 CAT<=IFR, RH>90)，不是条件时返回 None"""
+        match = cls.FILTER_PATTERN.match(token)
+        if not match or match.group(1) not in cls.COLUMNS:
+            return None
+        column, op, value = match.groups()
+        if column == 'CAT':
+            if value not in cls.CATEGORY_NAMES[1:]:
+                return None
+            return column, op, cls.CATEGORY_NAMES.index(value)
+        try:
+            return column, op, float(value)
+        except ValueError:
+            return None
+
+    def filter(self, conditions, stations=None):
+        """返回满足全部条件的站点；给定 stations 时只在其中筛选并保持顺序"""
+        mask = np.ones(len(self.stations), dtype=bool)
+        for column, op, value in conditions:
+            values = getattr(self, self.COLUMNS[column])
+            if column == 'CAT':
+                mask &= values > 0
+            else:
+                mask &= ~np.isnan(values)
+            with np.errstate(invalid='ignore'):
+                mask &= self.OPERATORS[op](values, value)
+        if stations is None:
+            return sorted(self.stations[i] for i in np.nonzero(mask)[0])
+        return [s for s in stations if s in self.index and mask[self.index[s]]]
+
+
+# --- 告警规则引擎 ---
+ALERTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alerts.txt')
+ALERTS_LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alerts.log')
+
+class AlertRule:
+    """一条已编译的告警规则，如 "ZBAA: WX~FZRA" 或 "*: RVR<550 AND CAT<=IFR" """
+    WEATHER_PATTERN = re.compile(r'^WX\s*(!?~)\s*([-+A-Z]+)$')
+
+    def __init__(self, rule_id, text):
+        self.rule_id = rule_id
+        self.text = text
+        scope, sep, expression = text.partition(':')
+        if not sep or not expression.strip():
+            raise ValueError(f"规则格式错误: {text}")
+        scope = scope.strip().upper()
+        self.stations = None if scope == '*' else frozenset(s.strip() for s in scope.split(',') if s.strip())
+
+        # 条件之间用 AND 连接; 数值条件复用派生参数列 (CAT/RH/RVR/VIS...)
+        self.conditions = []
+        self.weather = []
+        for part in re.split(r'\s+AND\s+', expression.strip().upper()):
+            weather_match = self.WEATHER_PATTERN.match(part)
+            condition = DerivedTable.parse_filter(part)
+            if weather_match:
+                self.weather.append((weather_match.group(1) == '~', weather_match.group(2)))
+            elif condition:
+                self.conditions.append(condition)
+            else:
+                raise ValueError(f"无法识别的条件: {part}")
+
+    def matches(self, index, derived, weather_groups):
+        for column, op, value in self.conditions:
+            current = getattr(derived, DerivedTable.COLUMNS[column])[index]
+            if column == 'CAT' and current == 0:
+                return False
+            if math.isnan(current) or not DerivedTable.OPERATORS[op](current, value):
+                return False
+        for expected, code in self.weather:
+            if any(code in group for group in weather_groups) != expected:
+                return False
+        return True
+
+
+class AlertEngine:
+    """增量告警：只对原始报文发生变化的站点评估相关规则，并去重、抑制重复告警"""
+
+    def __init__(self, rules=(), suppress_minutes=30, log_path=ALERTS_LOG_FILE, hook=None):
+        self.rules = list(rules)
+        self.suppress_seconds = suppress_minutes * 60
+        self.log_path = log_path
+        self.hook = hook
+        self.parser = METARParser()
+        # 规则按站点建立索引，通配规则单独存放
+        self.by_station = {}
+        self.wildcard = []
+        for rule in self.rules:
+            if rule.stations is None:
+                self.wildcard.append(rule)
+            else:
+                for station in rule.stations:
+                    self.by_station.setdefault(station, []).append(rule)
+        self.active = set()
+        self.last_fired = {}
+
+    @classmethod
+    def load(cls, path=ALERTS_FILE, **kwargs):
+        """从规则文件加载；支持 SUPPRESS <分钟> 和 HOOK <命令> 指令，# 开头为注释。
+        显式传入的参数优先于文件中的指令 (如 hook=None 可禁止调用钩子命令)"""
+        rules = []
+        options = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    directive, _, argument = line.partition(' ')
+                    if directive.upper() == 'SUPPRESS':
+                        options['suppress_minutes'] = float(argument)
+                    elif directive.upper() == 'HOOK':
+                        options['hook'] = argument.strip()
+                    else:
+                        rules.append(AlertRule(len(rules) + 1, line))
+        options.update(kwargs)
+        return cls(rules, **options)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def evaluate(self, changed_stations, metar_data, derived, now=None):
+        """评估变化站点，返回新触发的告警 [(站点, 规则, 报文)]"""
+        if not self.rules or derived is None:
+            return []
+        now = time.time() if now is None else now
+        alerts = []
+        for station in changed_stations:
+            rules = self.by_station.get(station, []) + self.wildcard
+            index = derived.index.get(station)
+            if not rules or index is None:
+                continue
+            line = metar_data.get(station, '')
+            weather_groups = self.parser.weather_groups(line)
+            for rule in rules:
+                key = (rule.rule_id, station)
+                if not rule.matches(index, derived, weather_groups):
+                    self.active.discard(key)
+                    continue
+                if key in self.active:
+                    continue
+                self.active.add(key)
+                if now - self.last_fired.get(key, -math.inf) < self.suppress_seconds:
+                    continue
+                self.last_fired[key] = now
+                alerts.append((station, rule, line))
+        if alerts:
+            self.dispatch(alerts)
+        return alerts
+
+    def dispatch(self, alerts):
+        """写入告警文件并调用外部钩子命令 (告警内容通过环境变量传入)"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    for station, rule, line in alerts:
+                        f.write(f"[{timestamp}] {station} 触发规则 {rule.text}: {line}\n")
+            except OSError:
+                pass
+        if self.hook:
+            for station, rule, line in alerts:
+                env = dict(os.environ, METAR_ALERT_STATION=station,
+                           METAR_ALERT_RULE=rule.text, METAR_ALERT_REPORT=line)
+                try:
+                    subprocess.Popen(self.hook, shell=True, env=env)
+                except OSError:
+                    pass
+
+
+# --- 报文历史 ---
+class ReportBlock:
+    """紧凑存储中的一个数据块：站点编号和观测时间为定长数组，报文在块写满后整体压缩"""
+    __slots__ = ('stations', 'minutes', 'lines', 'text', 'newest')
+
+    def __init__(self):
+        self.stations = array('H')  # 驻留后的站点编号
+        self.minutes = array('i')   # 观测时间 (Unix 分钟)
+        self.lines = []             # 未封存时的原始报文
+        self.text = None            # 封存后的压缩报文
+        self.newest = -2 ** 31
+
+    def __len__(self):
+        return len(self.minutes)
+
+    @property
+    def nbytes(self):
+        # 下载线程可能同时封存该块，各属性只读取一次 (seal 先写 text 再清空 lines)
+        lines, text = self.lines, self.text
+        total = (sys.getsizeof(self) + len(self.stations) * self.stations.itemsize
+                 + len(self.minutes) * self.minutes.itemsize)
+        if lines is not None:
+            total += sys.getsizeof(lines) + sum(sys.getsizeof(line) for line in list(lines))
+        else:
+            total += sys.getsizeof(text)
+        return total
+
+
+class CompactReportStore:
+    """紧凑的报文存储：站点代码驻留为整数编号，观测时间为定长整数数组，原始报文每 BLOCK_SIZE 条
+    用带预置字典的 zlib 整块压缩。报文文本和解析结果都在访问时才解码"""
+    BLOCK_SIZE = 256
+    # 导出到共享段时的块表: 块内首条报文的序号、条数、最新观测分钟、压缩报文的偏移和长度
+    BLOCK_DTYPE = np.dtype([('start', '<u8'), ('count', '<u4'), ('newest', '<i4'),
+                            ('text_offset', '<u8'), ('text_length', '<u8')])
+    # 预置字典: 报文中最常见的片段，提高小数据块的压缩率
+    ZDICT = ('Z 00000KT VRB 9999 CAVOK NSC NCD FEW0 SCT0 BKN0 OVC0 CB TCU Q10 Q09 A29 A30 M0 '
+             '-RA BR HZ FG -SN VCSH -SHRA -TSRA NOSIG BECMG TEMPO FM TL AT RMK AO2 SLP T0 '
+             '0KT 1KT 2KT 3KT 4KT 5KT 6KT 7KT 8KT 9KT 10SM ').encode('ascii')
+
+    def __init__(self):
+        self.station_ids = {}
+        self.station_names = []
+        self.blocks = deque()
+        self.count = 0
+        self.parser = METARParser()
+        self.cache = (None, None)  # 最近解压的块 (顺序扫描时只解压一次)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return (sys.getsizeof(self.station_ids) + sys.getsizeof(self.station_names)
+                + sum(block.nbytes for block in list(self.blocks)))
+
+    def append(self, station, minute, line):
+        station_id = self.station_ids.get(station)
+        if station_id is None:
+            station_id = self.station_ids[station] = len(self.station_names)
+            self.station_names.append(station)
+        block = self.blocks[-1] if self.blocks and self.blocks[-1].text is None else None
+        if block is None:
+            block = ReportBlock()
+            self.blocks.append(block)
+        block.stations.append(station_id)
+        block.minutes.append(minute)
+        block.lines.append(line)
+        block.newest = max(block.newest, minute)
+        self.count += 1
+        if len(block) >= self.BLOCK_SIZE:
+            self.seal(block)
+
+    def compress(self, lines):
+        compressor = zlib.compressobj(6, zdict=self.ZDICT)
+        return compressor.compress('\n'.join(lines).encode('utf-8')) + compressor.flush()
+
+    def seal(self, block):
+        block.text = self.compress(block.lines)
+        block.lines = None
+
+    def drop_oldest(self):
+        block = self.blocks.popleft()
+        self.count -= len(block)
+
+    def drop_before(self, minute):
+        """整块淘汰最新报文早于 minute 的数据块 (块内较旧的报文会随所在块稍晚淘汰)"""
+        while self.blocks and self.blocks[0].newest < minute:
+            self.drop_oldest()
+
+    def block_lines(self, block):
+        lines = block.lines
+        if lines is not None:
+            # 未封存的块可能正被下载线程追加，取副本 (站点和时间先于报文写入，副本长度不超过它们)
+            return list(lines)
+        cached_block, lines = self.cache
+        if cached_block is not block:
+            decompressor = zlib.decompressobj(zdict=self.ZDICT)
+            lines = (decompressor.decompress(block.text) + decompressor.flush()).decode('utf-8').split('\n')
+            self.cache = (block, lines)
+        return lines
+
+    def reports(self, start=None, end=None):
+        """逐条产出观测时间 (Unix 分钟) 在 [start, end] 内的 (站点, 分钟, 报文)"""
+        for block in list(self.blocks):
+            if start is not None and block.newest < start:
+                continue
+            lines = self.block_lines(block)
+            for station_id, minute, line in zip(block.stations.tolist(), block.minutes.tolist(), lines):
+                if (start is None or minute >= start) and (end is None or minute <= end):
+                    yield self.station_names[station_id], minute, line
+
+    def records(self, start=None, end=None):
+        """逐条产出解析后的报文 (与 METARParser.parse 相同的字典)，只在迭代到时才解析"""
+        for _, _, line in self.reports(start, end):
+            yield self.parser.parse(line)
+
+    def to_buffers(self):
+        """导出为定长数组 (站点代码、块表、站点编号、观测分钟) 和拼接的压缩报文，供写入共享段；
+        未封存的块单独压缩一份，不改变存储本身"""
+        blocks = list(self.blocks)
+        table = np.zeros(len(blocks), dtype=self.BLOCK_DTYPE)
+        stations, minutes, texts = [], [], []
+        start = text_offset = 0
+        for entry, block in zip(table, blocks):
+            lines, text, count = block.lines, block.text, len(block)
+            if lines is not None:
+                lines = list(lines)
+                text, count = self.compress(lines), len(lines)
+            entry['start'], entry['count'], entry['newest'] = start, count, block.newest
+            entry['text_offset'], entry['text_length'] = text_offset, len(text)
+            stations.append(np.frombuffer(block.stations[:count], dtype=np.uint16))
+            minutes.append(np.frombuffer(block.minutes[:count], dtype=np.int32))
+            texts.append(text)
+            start += count
+            text_offset += len(text)
+        names = np.array(self.station_names, dtype='S4')
+        stations = np.concatenate(stations) if stations else np.zeros(0, dtype=np.uint16)
+        minutes = np.concatenate(minutes) if minutes else np.zeros(0, dtype=np.int32)
+        return names, table, stations, minutes, b''.join(texts)
+
+    @classmethod
+    def from_buffers(cls, names, table, stations, minutes, text):
+        """由 to_buffers() 的结果 (可以是只读映射上的视图) 重建只读的存储，报文仍在访问时才解压"""
+        store = cls()
+        store.station_names = [name.decode('ascii') for name in names]
+        store.station_ids = {name: i for i, name in enumerate(store.station_names)}
+        for entry in table:
+            start, count = int(entry['start']), int(entry['count'])
+            offset = int(entry['text_offset'])
+            block = ReportBlock()
+            block.stations = stations[start:start + count]
+            block.minutes = minutes[start:start + count]
+            block.lines = None
+            block.text = text[offset:offset + int(entry['text_length'])]
+            block.newest = int(entry['newest'])
+            store.blocks.append(block)
+            store.count += count
+        return store
+
+
+class ReportHistory:
+    """保存保留时长内的全部不同报文，底层为 CompactReportStore；过期报文按数据块整块淘汰"""
+    RECENT_KEYS = 8  # 每站用于去重的最近报文数
+
+    def __init__(self, retention_hours=24, store=None):
+        self.retention = timedelta(hours=retention_hours)
+        self.parser = METARParser()
+        self.store = store if store is not None else CompactReportStore()
+        self.recent = {}  # 站点 -> array[(观测分钟 << 32) | CRC32]
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def nbytes(self):
+        recent = sum(sys.getsizeof(keys) for keys in list(self.recent.values()))
+        return self.store.nbytes + sys.getsizeof(self.recent) + recent
+
+    @staticmethod
+    def to_minute(moment):
+        return int(moment.timestamp() // 60)
+
+    def add(self, station, line, reference=None):
+        """添加一条报文，已存在或无法确定观测时间时返回 False"""
+        obs_time = self.parser.observation_time(line, reference)
+        if obs_time is None:
+            return False
+        minute = self.to_minute(obs_time)
+        key = (minute << 32) | zlib.crc32(line.encode('utf-8'))
+        keys = self.recent.get(station)
+        if keys is None:
+            keys = self.recent[station] = array('Q')
+        elif key in keys:
+            return False
+        elif len(keys) >= self.RECENT_KEYS:
+            oldest = min(keys)
+            if key < oldest:
+                return False  # 早于去重窗口的迟到报文视为已保存
+            keys.remove(oldest)
+        keys.append(key)
+        self.store.append(station, minute, line)
+        return True
+
+    def expire(self, now=None):
+        """淘汰超出保留时长的报文"""
+        self.evict_before((now or datetime.now(pytz.utc)) - self.retention)
+
+    def evict_before(self, cutoff):
+        minute = self.to_minute(cutoff)
+        self.store.drop_before(minute)
+        for station in list(self.recent):
+            if max(self.recent[station]) >> 32 < minute:
+                del self.recent[station]
+
+    def trim(self, max_bytes):
+        """超出内存预算时提前淘汰最旧的数据块 (至少保留最近 1 小时)"""
+        blocks = self.store.blocks
+        if not blocks:
+            return
+        keep_after = max(block.newest for block in blocks) - 60
+        while len(blocks) > 1 and blocks[0].newest < keep_after and self.nbytes > max_bytes:
+            self.store.drop_oldest()
+
+    def iter_range(self, start=None, end=None):
+        """逐条产出观测时间在 [start, end] 内的 (报文, 观测时间的 Unix 分钟)"""
+        start = self.to_minute(start) if start is not None else None
+        end = self.to_minute(end) if end is not None else None
+        for _, minute, line in self.store.reports(start, end):
+            yield line, minute
+
+
+# --- 滚动统计 ---
+class RollingWindow:
+    """单个站点窗口内的样本 (观测分钟, 温度, 阵风, 气压)，存于定长数组构成的环形缓冲区：
+    观测分钟为 array('i')，三个量交错存于 array('f')；缓冲区满时容量加倍，样本少于容量的四分之一时减半。
+    统计值不在这里保存，由 RollingStatistics 按站点编号存放在 NumPy 列中"""
+    __slots__ = ('slot', 'minutes', 'values', 'head', 'size', 'last', 'ifr_since')
+    QUANTITIES = ('temp', 'gust', 'qnh')
+    INITIAL_CAPACITY = 4
+
+    def __init__(self, slot):
+        self.slot = slot      # 在 RollingStatistics 统计列中的行号
+        self.minutes = array('i', bytes(4 * self.INITIAL_CAPACITY))
+        self.values = array('f', bytes(4 * len(self.QUANTITIES) * self.INITIAL_CAPACITY))
+        self.head = 0         # 最早样本的位置
+        self.size = 0
+        self.last = None      # 最新观测分钟
+        self.ifr_since = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def oldest(self):
+        return self.minutes[self.head]
+
+    def push(self, minute, values):
+        capacity = len(self.minutes)
+        if self.size == capacity:
+            self.resize(2 * capacity)
+            capacity *= 2
+        position = (self.head + self.size) % capacity
+        self.minutes[position] = minute
+        width = len(self.QUANTITIES)
+        self.values[position * width:(position + 1) * width] = array('f', values)
+        self.size += 1
+        self.last = minute
+
+    def pop(self):
+        """移除并返回最早的样本 (观测分钟, 温度, 阵风, 气压)"""
+        position = self.head
+        width = len(self.QUANTITIES)
+        sample = (self.minutes[position], *self.values[position * width:(position + 1) * width])
+        self.head = (position + 1) % len(self.minutes)
+        self.size -= 1
+        capacity = len(self.minutes)
+        if capacity > self.INITIAL_CAPACITY and self.size <= capacity // 4:
+            self.resize(capacity // 2)
+        return sample
+
+    def samples(self):
+        """按时间顺序产出窗口内的样本"""
+        capacity = len(self.minutes)
+        width = len(self.QUANTITIES)
+        for k in range(self.size):
+            position = (self.head + k) % capacity
+            yield (self.minutes[position], *self.values[position * width:(position + 1) * width])
+
+    def resize(self, capacity):
+        """按时间顺序展开到新容量的数组中 (整段切片复制)"""
+        width = len(self.QUANTITIES)
+        head, end = self.head, self.head + self.size
+        wrapped = max(end - len(self.minutes), 0)
+        minutes = self.minutes[head:end] + self.minutes[:wrapped]
+        values = self.values[head * width:end * width] + self.values[:wrapped * width]
+        minutes.frombytes(bytes(4 * (capacity - self.size)))
+        values.frombytes(bytes(4 * width * (capacity - self.size)))
+        self.minutes, self.values, self.head = minutes, values, 0
+
+    def nbytes(self):
+        # 下载线程可能同时扩容，各属性只读取一次；行号和最新观测分钟是独立的整数对象
+        minutes, values = self.minutes, self.values
+        return sys.getsizeof(self) + sys.getsizeof(minutes) + sys.getsizeof(values) + 2 * sys.getsizeof(2 ** 25)
+
+
+class RollingStatistics:
+    """随下载增量维护的每站滚动统计 (默认 24 小时)：温度和阵风的最小/最大/平均、
+    气压变化以及当前 IFR (含 LIFR) 已持续的时间。
+    每站分配一个行号，统计值 (累计和、计数、最值及其出现次数、首末有效气压) 存于按行号索引的 NumPy 列，
+    只对本次有新样本或有样本过期的站点更新：新样本批量计入，过期样本逐条扣除，
+    只有最值的最后一次出现被淘汰时才重新扫描该站窗口。各站最早样本的时间放在小顶堆中，过期检查只涉及到期的站点"""
+    IFR_CATEGORIES = (1, 2)
+    MIN_TRIM_MINUTES = 60  # 超出内存预算时至少保留最近 1 小时的样本
+
+    def __init__(self, window_hours=24):
+        self.window = timedelta(hours=window_hours)
+        self.parser = METARParser()
+        self.stations = {}     # 站点 -> RollingWindow
+        self.free_slots = []
+        self.expiry = []       # 小顶堆 [(最早样本的观测分钟, 站点)]
+        self.allocate(0)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def allocate(self, capacity):
+        """按行号存放的统计列 (每个量一列)，扩容时保留已有的行"""
+        width = len(RollingWindow.QUANTITIES)
+        old = getattr(self, 'total', None)
+        rows = 0 if old is None else len(old)
+
+        def grow(name, fill, shape=(width,), dtype=np.float64):
+            column = np.full((capacity, *shape) if shape else capacity, fill, dtype=dtype)
+            if rows:
+                column[:rows] = getattr(self, name)
+            setattr(self, name, column)
+
+        grow('total', 0.0)
+        grow('count', 0, dtype=np.int32)
+        grow('minimum', np.nan)
+        grow('min_count', 0, dtype=np.int32)
+        grow('maximum', np.nan)
+        grow('max_count', 0, dtype=np.int32)
+        grow('first_qnh', np.nan, shape=())
+        grow('last_qnh', np.nan, shape=())
+        grow('ifr_hours', 0.0, shape=())
+
+    def add_window(self, station):
+        if not self.free_slots:
+            capacity = len(self.total)
+            self.allocate(max(2 * capacity, 64))
+            self.free_slots = list(range(len(self.total) - 1, capacity - 1, -1))
+        window = self.stations[station] = RollingWindow(self.free_slots.pop())
+        return window
+
+    def release(self, slot):
+        """清空一行统计并回收行号 (站点窗口内已没有样本)"""
+        self.total[slot] = 0.0
+        self.count[slot] = self.min_count[slot] = self.max_count[slot] = 0
+        self.minimum[slot] = self.maximum[slot] = np.nan
+        self.first_qnh[slot] = self.last_qnh[slot] = np.nan
+        self.ifr_hours[slot] = 0.0
+        self.free_slots.append(slot)
+
+    def ingest(self, changed_stations, metar_data, derived, reference=None):
+        """把变化站点的当前报文计入统计，数值直接取自本次计算的派生参数表"""
+        pending = []  # (窗口, 派生参数表中的下标, 观测分钟)
+        for station in changed_stations:
+            i = derived.index.get(station)
+            if i is None:
+                continue
+            obs_time = self.parser.observation_time(metar_data[station], reference)
+            if obs_time is None:
+                continue
+            minute = int(obs_time.timestamp() // 60)
+            window = self.stations.get(station)
+            if window is None:
+                window = self.add_window(station)
+                heapq.heappush(self.expiry, (minute, station))
+            elif minute <= window.last:
+                continue  # 迟到或重复的报文不影响滚动统计
+            pending.append((window, i, minute))
+        if not pending:
+            return
+        indices = np.fromiter((i for _, i, _ in pending), dtype=np.intp, count=len(pending))
+        # 没有阵风组时以平均风速作为该次观测的最大风；
+        # 先转为 float32，与环形缓冲区中保存的值一致，淘汰时才能精确扣除并与最值比较
+        gust = derived.wind_gust[indices]
+        values = np.column_stack((derived.temp[indices], np.where(np.isnan(gust), derived.wind_speed[indices], gust),
+                                  derived.qnh[indices])).astype(np.float32)
+        ifr_hours = []
+        for (window, _, minute), sample, category in zip(pending, values.tolist(), derived.category[indices].tolist()):
+            window.push(minute, sample)
+            if category in self.IFR_CATEGORIES:
+                if window.ifr_since is None:
+                    window.ifr_since = minute
+            elif category:
+                window.ifr_since = None
+            ifr_hours.append((minute - window.ifr_since) / 60 if window.ifr_since is not None else 0.0)
+        slots = np.fromiter((window.slot for window, _, _ in pending), dtype=np.intp, count=len(pending))
+        self.ifr_hours[slots] = ifr_hours
+        values = values.astype(np.float64)
+        valid = ~np.isnan(values)
+        self.total[slots] += np.where(valid, values, 0.0)
+        self.count[slots] += valid
+        with np.errstate(invalid='ignore'):
+            for extreme, occurrences, better in ((self.minimum, self.min_count, np.less),
+                                                 (self.maximum, self.max_count, np.greater)):
+                current = extreme[slots]
+                replace = valid & (np.isnan(current) | better(values, current))
+                occurrences[slots] = np.where(replace, 1, occurrences[slots] + (values == current))
+                extreme[slots] = np.where(replace, values, current)
+        qnh = values[:, 2]
+        has_qnh = valid[:, 2]
+        self.last_qnh[slots[has_qnh]] = qnh[has_qnh]
+        first = has_qnh & np.isnan(self.first_qnh[slots])
+        self.first_qnh[slots[first]] = qnh[first]
+
+    def expire(self, now=None):
+        """淘汰窗口外的样本，窗口内已无任何报文的站点整体移除"""
+        self.evict_before(math.ceil(((now or datetime.now(pytz.utc)) - self.window).timestamp() / 60))
+
+    def evict_before(self, cutoff):
+        """淘汰观测分钟早于 cutoff 的样本：只处理最早样本已到期的站点，被淘汰的样本批量从统计中扣除"""
+        expiry = self.expiry
+        touched = {}  # 行号 -> 窗口
+        slots, samples = [], []
+        while expiry and expiry[0][0] < cutoff:
+            minute, station = heapq.heappop(expiry)
+            window = self.stations.get(station)
+            if window is None or window.oldest != minute:
+                continue  # 站点已移除后重新加入留下的过期条目
+            while window.size and window.oldest < cutoff:
+                slots.append(window.slot)
+                samples.append(window.pop()[1:])
+            touched[window.slot] = window
+            if window.size:
+                heapq.heappush(expiry, (window.oldest, station))
+            else:
+                del self.stations[station]
+        if not slots:
+            return
+        slots = np.array(slots, dtype=np.intp)
+        values = np.array(samples, dtype=np.float64)
+        valid = ~np.isnan(values)
+        np.subtract.at(self.total, slots, np.where(valid, values, 0.0))
+        np.subtract.at(self.count, slots, valid.astype(np.int32))
+        np.subtract.at(self.min_count, slots, (values == self.minimum[slots]).astype(np.int32))
+        np.subtract.at(self.max_count, slots, (values == self.maximum[slots]).astype(np.int32))
+
+        rows = np.fromiter(touched, dtype=np.intp, count=len(touched))
+        self.total[rows] = np.where(self.count[rows] > 0, self.total[rows], 0.0)  # 计数归零时清除累计误差
+        # 最值的最后一次出现被淘汰的量需要重新扫描窗口
+        stale = (((self.min_count[rows] == 0) & ~np.isnan(self.minimum[rows]))
+                 | ((self.max_count[rows] == 0) & ~np.isnan(self.maximum[rows])))
+        # 样本按时间顺序淘汰，淘汰了有效气压的站点需要向后找到新的最早有效气压
+        qnh_rows = set(slots[valid[:, 2]].tolist())
+        for row, stale_row in zip(rows.tolist(), stale):
+            window = touched[row]
+            if not window.size:
+                self.release(row)
+                continue
+            if stale_row.any():
+                self.rescan(window, np.nonzero(stale_row)[0].tolist())
+            if row in qnh_rows:
+                qnh = next((values[2] for _, *values in window.samples() if not math.isnan(values[2])), math.nan)
+                self.first_qnh[row] = qnh
+                if math.isnan(qnh):
+                    self.last_qnh[row] = math.nan
+
+    def rescan(self, window, quantities):
+        """最值的最后一次出现被淘汰后，重新扫描该站窗口求这些量的最值及其出现次数"""
+        slot = window.slot
+        for q in quantities:
+            minimum = maximum = math.nan
+            min_count = max_count = 0
+            for _, *values in window.samples():
+                value = values[q]
+                if math.isnan(value):
+                    continue
+                if not min_count or value < minimum:
+                    minimum, min_count = value, 1
+                elif value == minimum:
+                    min_count += 1
+                if not max_count or value > maximum:
+                    maximum, max_count = value, 1
+                elif value == maximum:
+                    max_count += 1
+            self.minimum[slot, q], self.min_count[slot, q] = minimum, min_count
+            self.maximum[slot, q], self.max_count[slot, q] = maximum, max_count
+
+    def trim(self, max_bytes):
+        """超出内存预算时按小时提前淘汰最旧的样本 (至少保留最近 1 小时)"""
+        if not self.expiry:
+            return
+        newest = max(window.last for window in self.stations.values())
+        cutoff = self.expiry[0][0]
+        while cutoff < newest - self.MIN_TRIM_MINUTES and self.nbytes() > max_bytes:
+            cutoff = min(cutoff + 60, newest - self.MIN_TRIM_MINUTES)
+            self.evict_before(cutoff)
+
+    def columns(self, stations):
+        """按给定站点顺序返回各统计列的数组 (没有统计的站点为 NaN)，只是按行号取值"""
+        lookup = self.stations.get
+        slots = np.fromiter((-1 if (window := lookup(station)) is None else window.slot for station in stations),
+                            dtype=np.intp, count=len(stations))
+        present = slots >= 0
+        rows = slots[present]
+        count = self.count[rows]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, self.total[rows] / count, np.nan)
+        values = {}
+
+        def column(row_values):
+            values_ = np.full(len(stations), np.nan)
+            values_[present] = row_values
+            return values_
+
+        for q, name in enumerate(RollingWindow.QUANTITIES):
+            values[f'{name}_min'] = column(self.minimum[rows, q])
+            values[f'{name}_max'] = column(self.maximum[rows, q])
+            values[f'{name}_mean'] = column(mean[:, q])
+        values['qnh_change'] = column(self.last_qnh[rows] - self.first_qnh[rows])
+        values['ifr_hours'] = column(self.ifr_hours[rows])
+        return values
+
+    def nbytes(self):
+        """内存估算: 站点字典 (含站点代码)、过期堆、每站环形缓冲区和统计列的实际大小之和"""
+        stations, expiry = self.stations, self.expiry
+        items = list(stations.items())
+        columns = (self.total, self.count, self.minimum, self.min_count, self.maximum, self.max_count,
+                   self.first_qnh, self.last_qnh, self.ifr_hours)
+        return (sys.getsizeof(stations) + sum(sys.getsizeof(station) + window.nbytes() for station, window in items)
+                + sys.getsizeof(expiry) + len(expiry) * (sys.getsizeof((0, '')) + sys.getsizeof(2 ** 25))
+                + sys.getsizeof(self.free_slots) + sum(column.nbytes for column in columns))
+
+
+# --- 内存统计与预算 ---
+class MemoryAccountant:
+    """按子系统统计内存占用，并在超出预算时调用子系统的回收函数。
+    子系统大小为结构估算 (Python 对象大小之和、NumPy 数组字节数、Qt 文档字符数)；
+    启用 tracemalloc 时报告中附带 Python 堆的总量、峰值和主要分配位置"""
+    UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+    LABELS = {
+        'metar_data': '报文缓存', 'history': '报文历史', 'derived': '派生参数', 'rolling': '滚动统计',
+        'query_history': '查询历史', 'log_text': '系统日志', 'result_text': '查询结果',
+        'shared_cache': '共享缓存段 (只读映射)',
+    }
+    # 可设置预算的子系统，其余只统计
+    # 报文缓存只保存当前周期文件中每站最新一条，其大小已由周期文件限定，不参与回收：
+    # 淘汰后的站点会在下个周期被误判为报文变化，并导致查询随机失败
+    EVICTABLE = ('history', 'rolling', 'query_history', 'log_text', 'result_text')
+
+    def __init__(self, budgets=None):
+        self.budgets = dict(budgets or {})
+        self.subsystems = {}  # 名称 -> (测量函数, 回收函数)
+        self.evictions = {}
+        self.unmet = set()  # 超出预算但已无可回收数据的子系统
+
+    @classmethod
+    def parse_size(cls, text):
+        match = re.fullmatch(r'([\d.]+)\s*([KMG]?B)?', text.strip().upper())
+        if not match:
+            raise ValueError(f"无法识别的大小: {text}")
+        return int(float(match.group(1)) * cls.UNITS[match.group(2) or 'B'])
+
+    @classmethod
+    def parse_budgets(cls, specs):
+        """解析 NAME=SIZE 形式的预算 (如 history=50MB)"""
+        budgets = {}
+        for spec in specs:
+            name, _, size = spec.partition('=')
+            name = name.strip().lower()
+            if name not in cls.EVICTABLE:
+                raise ValueError(f"不支持预算的子系统: {name} (可用: {', '.join(cls.EVICTABLE)})")
+            budgets[name] = cls.parse_size(size)
+        return budgets
+
+    @staticmethod
+    def format_size(nbytes):
+        if nbytes >= 1024 ** 3:
+            return f'{nbytes / 1024 ** 3:.2f} GB'
+        if nbytes >= 1024 ** 2:
+            return f'{nbytes / 1024 ** 2:.1f} MB'
+        if nbytes >= 1024:
+            return f'{nbytes / 1024:.1f} KB'
+        return f'{nbytes:.0f} B'
+
+    @staticmethod
+    def sizeof_strings(container):
+        """容器本身加其中字符串的大小 (映射包括键)，适用于报文缓存和查询历史"""
+        if isinstance(container, dict):
+            items = [x for pair in list(container.items()) for x in pair]
+        else:
+            items = list(container)
+        return sys.getsizeof(container) + sum(sys.getsizeof(x) for x in items)
+
+    @staticmethod
+    def sizeof_arrays(obj):
+        """对象持有的 NumPy 数组字节数 (共享缓存段的视图不计入)"""
+        if obj is None:
+            return 0
+        return sum(v.nbytes for v in vars(obj).values() if isinstance(v, np.ndarray) and v.flags.owndata)
+
+    def register(self, name, measure, evict=None):
+        self.subsystems[name] = (measure, evict)
+
+    def sizes(self):
+        return {name: measure() for name, (measure, _) in list(self.subsystems.items())}
+
+    def enforce(self, names=None):
+        """对超出预算的子系统执行回收，返回 [(名称, 回收前字节数, 回收后字节数)]。
+        只返回确实回收了内存的子系统，以及首次发现无法回收 (如历史已降到保留下限) 的子系统；
+        回收函数由拥有该数据的线程调用，names 用于限定本线程负责的子系统"""
+        results = []
+        for name in names or list(self.subsystems):
+            measure, evict = self.subsystems.get(name, (None, None))
+            budget = self.budgets.get(name)
+            if evict is None or budget is None:
+                continue
+            before = measure()
+            if before <= budget:
+                self.unmet.discard(name)
+                continue
+            evict(budget)
+            after = measure()
+            if after < before:
+                self.evictions[name] = self.evictions.get(name, 0) + 1
+                self.unmet.discard(name)
+                results.append((name, before, after))
+            elif name not in self.unmet:
+                self.unmet.add(name)
+                results.append((name, before, after))
+        return results
+
+    def describe_enforcement(self, name, before, after):
+        """enforce() 单条结果的日志文本"""
+        fmt = self.format_size
+        label = self.LABELS.get(name, name)
+        if after < before:
+            return f"{label}超出内存预算，已回收: {fmt(before)} → {fmt(after)}"
+        return (f"{label}占用 {fmt(before)}，超出内存预算 {fmt(self.budgets[name])}，"
+                f"但已没有可回收的数据，无法满足预算")
+
+    def report(self, top=0):
+        """返回各子系统大小；top > 0 且正在 tracemalloc 时附带前 top 个分配位置 (需要拍快照，较慢)"""
+        sizes = self.sizes()
+        report = {'subsystems': sizes, 'total': sum(sizes.values())}
+        if tracemalloc.is_tracing():
+            report['traced'], report['traced_peak'] = tracemalloc.get_traced_memory()
+            if top:
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(False, tracemalloc.__file__)])
+                report['top'] = [(f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                                  stat.size) for stat in snapshot.statistics('lineno')[:top]]
+        return report
+
+    def describe(self, report=None):
+        report = report or self.report()
+        fmt = self.format_size
+        lines = [f"内存占用 (估算) 合计 {fmt(report['total'])}:"]
+        for name, size in report['subsystems'].items():
+            line = f"  {self.LABELS.get(name, name)} ({name}): {fmt(size)}"
+            if name in self.budgets:
+                line += f" / 预算 {fmt(self.budgets[name])}，已回收 {self.evictions.get(name, 0)} 次"
+                if name in self.unmet:
+                    line += "，无法满足"
+            lines.append(line)
+        if 'traced' in report:
+            lines.append(f"  Python 堆 (tracemalloc): 当前 {fmt(report['traced'])}，峰值 {fmt(report['traced_peak'])}")
+        for location, size in report.get('top', ()):
+            lines.append(f"    {location}: {fmt(size)}")
+        return '\n'.join(lines)
+
+
+# --- 数据导出 ---
+class ReportExporter:
+    """把报文分块解码为列式数据，并流式写出为 CSV / JSON Lines / Parquet / Arrow。
+    输入为 (报文, 观测时间的 Unix 分钟) 序列：历史报文使用存储中的观测分钟，
+    当前缓存没有保存观测时间，分钟为 None，按参考时间从 DDHHMM 推算"""
+    FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl',
+               '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+    NUMERIC_COLUMNS = ('wind_dir', 'wind_speed', 'wind_gust', 'visibility', 'ceiling',
+                       'temp', 'dew', 'qnh', 'rvr', 'rh', 'pressure_alt', 'density_alt',
+                       'max_crosswind', 'min_headwind')
+    COLUMNS = ('station', 'observation_time') + NUMERIC_COLUMNS + ('category', 'weather', 'raw')
+
+    def __init__(self, station_table=None, chunk_size=5000):
+        self.parser = METARParser()
+        self.station_table = station_table if station_table is not None else load_station_table()
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def detect_format(cls, path):
+        fmt = cls.FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise ValueError(f"无法根据扩展名识别导出格式: {path}")
+        return fmt
+
+    def iter_chunks(self, reports, reference):
+        """每 chunk_size 条报文解码成一个列式数据块"""
+        batch = []
+        for report in reports:
+            batch.append(report)
+            if len(batch) >= self.chunk_size:
+                yield self.decode_chunk(batch, reference)
+                batch = []
+        if batch:
+            yield self.decode_chunk(batch, reference)
+
+    def decode_chunk(self, reports, reference):
+        lines = [line for line, _ in reports]
+        stations = [line.split()[0] for line in lines]
+        derived = DerivedTable(stations, [self.parser.extract_fields(line) for line in lines], self.station_table)
+        chunk = {'station': stations, 'observation_time': []}
+        for line, minute in reports:
+            if minute is not None:
+                obs_time = datetime.fromtimestamp(minute * 60, pytz.utc)
+            else:
+                obs_time = self.parser.observation_time(line, reference)
+            chunk['observation_time'].append(obs_time.strftime('%Y-%m-%dT%H:%MZ') if obs_time else None)
+        for name in self.NUMERIC_COLUMNS:
+            chunk[name] = getattr(derived, name)
+        chunk['category'] = [DerivedTable.CATEGORY_NAMES[c] or None for c in derived.category]
+        chunk['weather'] = [' '.join(self.parser.weather_groups(line)) or None for line in lines]
+        chunk['raw'] = list(lines)
+        return chunk
+
+    def iter_rows(self, chunk):
+        """把列式数据块转换成行 (NaN 转为 None)"""
+        columns = []
+        for name in self.COLUMNS:
+            values = chunk[name]
+            if name in self.NUMERIC_COLUMNS:
+                values = [None if v != v else round(v, 2) for v in values.tolist()]
+            columns.append(values)
+        return zip(*columns)
+
+    def export(self, reports, path, fmt=None, progress=None, reference=None):
+        """导出 (报文, 观测分钟) 序列，返回写出的条数；reference 为推算缓存报文观测时间的参考时间
+        (默认本机时间)，progress(已写条数) 在每个数据块写完后调用"""
+        fmt = fmt or self.detect_format(path)
+        if fmt in ('parquet', 'arrow') and pa is None:
+            raise RuntimeError("导出 Parquet/Arrow 需要安装 pyarrow")
+        reference = reference or datetime.now(pytz.utc)
+        written = 0
+        with getattr(self, f'_open_{fmt}')(path) as write_chunk:
+            for chunk in self.iter_chunks(reports, reference):
+                write_chunk(chunk)
+                written += len(chunk['raw'])
+                if progress:
+                    progress(written)
+        return written
+
+    @contextmanager
+    def _open_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.COLUMNS)
+            yield lambda chunk: writer.writerows(self.iter_rows(chunk))
+
+    @contextmanager
+    def _open_jsonl(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            yield lambda chunk: f.writelines(
+                json.dumps(dict(zip(self.COLUMNS, row)), ensure_ascii=False) + '\n'
+                for row in self.iter_rows(chunk))
+
+    def _arrow_schema(self):
+        return pa.schema([(name, pa.float64() if name in self.NUMERIC_COLUMNS else pa.string())
+                          for name in self.COLUMNS])
+
+    def _arrow_table(self, chunk, schema):
+        arrays = [pa.array(chunk[field.name], type=field.type, from_pandas=True) for field in schema]
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    @contextmanager
+    def _open_parquet(self, path):
+        schema = self._arrow_schema()
+        with pq.ParquetWriter(path, schema) as writer:
+            yield lambda chunk: writer.write_table(self._arrow_table(chunk, schema))
+
+    @contextmanager
+    def _open_arrow(self, path):
+        schema = self._arrow_schema()
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            yield lambda chunk: writer.write_table(self._arrow_table(chunk, schema))
+
+
+# --- 数据源 ---
+NOAA_BASE_URL = "https://tgftp.nws.noaa.gov/data/observations/metar"
+
+class SimulatedClock:
+    """可加速、可手动拨动的模拟 UTC 时钟；speed=0 时冻结在设定时间"""
+
+    def __init__(self, start=None, speed=1.0):
+        self.speed = speed
+        self._anchor = (start or datetime.now(pytz.utc), time.monotonic())
+        self.start = self._anchor[0]
+
+    def now(self):
+        moment, origin = self._anchor
+        return moment + timedelta(seconds=(time.monotonic() - origin) * self.speed)
+
+    def set(self, moment):
+        self._anchor = (moment, time.monotonic())
+
+
+class RemoteClock:
+    """读取替身服务器的模拟时间 (/clock)，失败时退回本机时间"""
+
+    def __init__(self, base_url):
+        self.url = f"{base_url.rstrip('/')}/clock"
+
+    def now(self):
+        try:
+            response = requests.get(self.url, timeout=3)
+            response.raise_for_status()
+            return datetime.fromisoformat(response.text.strip())
+        except (requests.exceptions.RequestException, ValueError):
+            return datetime.now(pytz.utc)
+
+
+class EndpointStats:
+    """单个端点最近若干次请求的延迟、错误率和流量"""
+
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.wins = 0
+        self.bytes = 0
+
+    def record(self, latency=None, nbytes=0):
+        """latency 为 None 表示请求失败"""
+        self.requests += 1
+        self.bytes += nbytes
+        self.outcomes.append(latency is not None)
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def percentile(self, q):
+        return float(np.percentile(self.latencies, q)) if self.latencies else None
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self):
+        """越小越优先；从未请求过的端点得分为 0，保证每个端点都会被试用；
+        最近的请求全部失败 (或从未成功) 的端点排在最后，只作为备用"""
+        if not self.requests:
+            return 0.0
+        error_rate = self.error_rate()
+        if not self.latencies or error_rate >= 1.0:
+            return float('inf')
+        return self.percentile(50) * (1 + 4 * error_rate)
+
+
+class HedgedFetcher:
+    """对冲请求：首选端点超过其延迟分位数仍未返回 (或直接失败) 时向下一个镜像再发一份请求，
+    采用先完成的结果并中止其余请求；按延迟和错误率为端点排序"""
+    MIN_SAMPLES = 5
+
+    class Cancelled(Exception):
+        pass
+
+    def __init__(self, base_urls, hedge_percentile=90, default_hedge_delay=2.0, timeout=15):
+        self.endpoints = {url.rstrip('/'): EndpointStats() for url in base_urls}
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.endpoints) + 2)
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=1000)
+        self.fetches = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.bytes = 0
+        self.wasted_bytes = 0
+
+    def ranked(self):
+        return sorted(self.endpoints, key=lambda url: self.endpoints[url].score())
+
+    def hedge_delay(self, url):
+        stats = self.endpoints[url]
+        if len(stats.latencies) < self.MIN_SAMPLES:
+            return self.default_hedge_delay
+        return stats.percentile(self.hedge_percentile)
+
+    def _fetch(self, base_url, path, cancel):
+        """流式读取响应，发现已被取消时立即停止；读到的字节计入浪费流量"""
+        start = time.perf_counter()
+        nbytes = 0
+        try:
+            response = requests.get(base_url + path, timeout=self.timeout, stream=True)
+            response.raise_for_status()
+            parts = []
+            for part in response.iter_content(chunk_size=65536):
+                nbytes += len(part)
+                if cancel.is_set():
+                    response.close()
+                    raise self.Cancelled()
+                parts.append(part)
+            text = b''.join(parts).decode(response.encoding or 'utf-8', errors='replace')
+        except self.Cancelled:
+            # 被取消的请求至少耗时这么久，作为延迟下界计入，避免慢端点一直排在首位
+            with self.lock:
+                self.bytes += nbytes
+                self.wasted_bytes += nbytes
+                self.endpoints[base_url].record(time.perf_counter() - start, nbytes)
+            raise
+        except Exception:
+            with self.lock:
+                self.bytes += nbytes
+                self.endpoints[base_url].record(None, nbytes)
+            raise
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.bytes += nbytes
+            self.endpoints[base_url].record(latency, nbytes)
+        return text, nbytes
+
+    def fetch(self, path):
+        """获取 path (如 /cycles/05Z.TXT)，返回文本"""
+        order = self.ranked()
+        cancel = threading.Event()
+        start = time.perf_counter()
+        pending = {self.executor.submit(self._fetch, order[0], path, cancel): order[0]}
+        backups = order[1:]
+        deadline = start + self.hedge_delay(order[0])
+        last_error = None
+        try:
+            while pending:
+                timeout = max(deadline - time.perf_counter(), 0) if backups else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                winner = None
+                for future in done:
+                    url = pending.pop(future)
+                    try:
+                        text, nbytes = future.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if winner is None:
+                        winner = (url, text)
+                    else:
+                        with self.lock:
+                            self.wasted_bytes += nbytes
+                if winner:
+                    url, text = winner
+                    with self.lock:
+                        self.fetches += 1
+                        self.latencies.append(time.perf_counter() - start)
+                        self.endpoints[url].wins += 1
+                        if url != order[0]:
+                            self.hedge_wins += 1
+                    return text
+                # 超过对冲延迟或全部失败时，启动下一个端点
+                if backups and (not done or not pending):
+                    url = backups.pop(0)
+                    with self.lock:
+                        self.hedges += 1
+                    pending[self.executor.submit(self._fetch, url, path, cancel)] = url
+                    deadline = time.perf_counter() + self.hedge_delay(url)
+        finally:
+            cancel.set()
+        raise last_error or requests.exceptions.RequestException("所有端点均请求失败")
+
+    def report(self):
+        """返回尾延迟、对冲次数和浪费流量等统计"""
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        with self.lock:
+            return {
+                'fetches': self.fetches, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'bytes': self.bytes, 'wasted_bytes': self.wasted_bytes,
+                'endpoints': {url: {'requests': st.requests, 'wins': st.wins,
+                                    'p50_ms': (st.percentile(50) or 0) * 1000,
+                                    'error_rate': st.error_rate()}
+                              for url, st in self.endpoints.items()},
+            }
+
+    def describe(self):
+        r = self.report()
+        return (f"对冲统计: 请求 {r['fetches']} 次，延迟 p50 {r['p50_ms']:.0f} / p95 {r['p95_ms']:.0f} / "
+                f"p99 {r['p99_ms']:.0f} 毫秒，对冲 {r['hedges']} 次 (备用胜出 {r['hedge_wins']} 次)，"
+                f"浪费流量 {r['wasted_bytes'] / 1024:.0f} KB / 共 {r['bytes'] / 1024:.0f} KB")
+
+
+class MetarSource:
+    """METAR 数据源：base_url 下提供 cycles/HHZ.TXT 和 stations/XXXX.TXT (NOAA 或本地替身服务器)"""
+
+    def __init__(self, base_url=NOAA_BASE_URL, clock=None, mirrors=()):
+        self.base_url = base_url.rstrip('/')
+        self.clock = clock
+        self.requests = 0
+        self.bytes_received = 0
+        # 配置了镜像时，周期文件通过对冲请求获取
+        self.hedger = HedgedFetcher([self.base_url, *mirrors]) if mirrors else None
+
+    def now(self):
+        return self.clock.now() if self.clock else datetime.now(pytz.utc)
+
+    def cycle_url(self, hour):
+        return f"{self.base_url}/cycles/{hour:02d}Z.TXT"
+
+    def station_url(self, icao_code):
+        return f"{self.base_url}/stations/{icao_code}.TXT"
+
+    def status_url(self):
+        return f"{self.base_url}/stations/"
+
+    def get(self, url, timeout):
+        response = requests.get(url, timeout=timeout)
+        self.requests += 1
+        self.bytes_received += len(response.content)
+        response.raise_for_status()
+        return response.text
+
+    def fetch_cycle(self, hour, timeout=15):
+        if self.hedger is None:
+            return self.get(self.cycle_url(hour), timeout)
+        text = self.hedger.fetch(f"/cycles/{hour:02d}Z.TXT")
+        self.requests = self.hedger.fetches
+        self.bytes_received = self.hedger.bytes
+        return text
+
+    def fetch_station(self, icao_code, timeout=10):
+        return self.get(self.station_url(icao_code), timeout)
+
 
 # --- 统计面板类 ---
 class StatsPanel(QWidget):
@@ -428,10 +2121,13 @@ class StatsPanel(QWidget):
         self.failed_requests_label = QLabel("失败: 0")
         self.success_rate_label = QLabel("成功率: 0%")
         self.last_update_label = QLabel("最后更新: 未知")
+        self.memory_label = QLabel("内存: 统计中...")
+        self.memory_label.setWordWrap(True)
         
         # 设置样式
         for label in [self.total_requests_label, self.successful_requests_label, 
-                     self.failed_requests_label, self.success_rate_label, self.last_update_label]:
+                     self.failed_requests_label, self.success_rate_label, self.last_update_label,
+                     self.memory_label]:
             label.setObjectName("statsLabel")
             label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         
@@ -441,6 +2137,7 @@ class StatsPanel(QWidget):
         layout.addWidget(self.failed_requests_label, 1, 0)
         layout.addWidget(self.success_rate_label, 1, 1)
         layout.addWidget(self.last_update_label, 2, 0, 1, 2)
+        layout.addWidget(self.memory_label, 3, 0, 1, 2)
         
         self.setLayout(layout)
         
@@ -457,6 +2154,12 @@ class StatsPanel(QWidget):
         else:
             self.failed_requests += 1
         self.update_display()
+
+    def add_requests(self, successes, failures):
+        self.total_requests += successes + failures
+        self.successful_requests += successes
+        self.failed_requests += failures
+        self.update_display()
         
     def update_display(self):
         self.total_requests_label.setText(f"总请求: {self.total_requests}")
@@ -472,32 +2175,42 @@ class StatsPanel(QWidget):
         current_time = datetime.now().strftime("%H:%M:%S")
         self.last_update_label.setText(f"最后更新: {current_time}")
 
+    def update_memory(self, report, details):
+        """显示内存合计和主要子系统，完整明细放在悬停提示中"""
+        fmt = MemoryAccountant.format_size
+        sizes = report['subsystems']
+        largest = sorted(sizes, key=sizes.get, reverse=True)[:3]
+        text = f"内存: {fmt(report['total'])}"
+        if 'traced' in report:
+            text += f" (堆 {fmt(report['traced'])})"
+        text += "\n" + " · ".join(f"{MemoryAccountant.LABELS.get(n, n)} {fmt(sizes[n])}" for n in largest)
+        self.memory_label.setText(text)
+        self.memory_label.setToolTip(details)
+
 # --- METAR 查找线程 ---
 class MetarFinderThread(QThread):
     result_ready = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
     progress_updated = pyqtSignal(int)
     
-    def __init__(self, icao_code):
+    def __init__(self, icao_code, source=None):
         super().__init__()
         self.icao_code = icao_code
+        self.source = source or MetarSource()
     
     def run(self):
         try:
             # 开始进度
             self.progress_updated.emit(10)
             
-            # 构建URL
-            url = f"https://tgftp.nws.noaa.gov/data/observations/metar/stations/{self.icao_code.upper()}.TXT"
             self.progress_updated.emit(30)
             
-            # 发送请求
-            response = requests.get(url, timeout=10)
+            # 通过数据源请求单站报文 (与周期文件共用请求计数和错误处理)
+            text = self.source.fetch_station(self.icao_code.upper())
             self.progress_updated.emit(70)
-            response.raise_for_status()
             
             # 解析响应
-            lines = response.text.strip().split('\n')
+            lines = text.strip().split('\n')
             self.progress_updated.emit(90)
             
             if len(lines) >= 2:
@@ -516,53 +2229,932 @@ class MetarFinderThread(QThread):
         except Exception as e:
             self.error_occurred.emit(f"未知错误: {str(e)}")
 
-# --- 后台下载线程 (使用同步请求) ---
-class DownloaderThread(QThread):
+# --- 数据导出线程 ---
+class ExportThread(QThread):
+    """导出下载线程 (或共享缓存) 的当前缓存，或以数据源时钟为准的最近 hours 小时历史"""
     log_signal = pyqtSignal(str)
-    update_complete_signal = pyqtSignal(int)
-    metar_data = {}
+    export_complete_signal = pyqtSignal(int, str)
+
+    def __init__(self, downloader, path, hours=None, fmt=None):
+        super().__init__()
+        self.downloader = downloader
+        self.path = path
+        self.hours = hours
+        self.fmt = fmt
 
     def run(self):
-        while True:
-            self.download_metar_file()
-            self.log_signal.emit("60秒后开始下一次下载周期。")
+        start = time.perf_counter()
+        try:
+            # 读取数据源时钟可能需要网络请求，放在导出线程中
+            now = self.downloader.now()
+            if self.hours is None:
+                reports = [(line, None) for line in self.downloader.metar_data.values()]
+            else:
+                reports = self.downloader.history.iter_range(now - timedelta(hours=self.hours))
+            exporter = ReportExporter()
+            count = exporter.export(reports, self.path, self.fmt, reference=now,
+                                    progress=lambda n: self.log_signal.emit(f"已导出 {n} 条报文..."))
+        except Exception as e:
+            self.log_signal.emit(f"导出失败: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        self.log_signal.emit(f"导出完成: {count} 条报文写入 {self.path}，耗时 {elapsed:.2f} 秒。")
+        self.export_complete_signal.emit(count, self.path)
+
+# --- 查询与渲染线程 ---
+class QueryThread(QThread):
+    """在工作线程中解析查询、解码报文并渲染结果卡片，HTML 也在工作线程中解析为文档片段，分批发回界面；
+    generation 用于丢弃过期查询的结果，cancel() 让过期查询尽快停止。
+    界面每插入一批后调用 acknowledge() 并给出按实测插入耗时算出的下一批大小，
+    工作线程最多领先一批，避免积压的批次连续占用事件循环"""
+    query_started = pyqtSignal(int, list)
+    chunk_ready = pyqtSignal(int, object, int, int, int)  # 批次内容为 QTextDocumentFragment
+    query_finished = pyqtSignal(int, list, int, str)
+    query_failed = pyqtSignal(int, str)
+    CHUNK_SIZE = 10       # 界面给出实测批次大小之前使用
+    MAX_CHUNK_SIZE = 100
+    TAB_STOP = 180        # 卡片中名称列的宽度 (像素)，结果区以此作为制表位间距
+    HEADER_HTML = ("<div style='font-family: Segoe UI, Arial, sans-serif;'>"
+                   "<h2 style='color:#88C0D0; text-align: center; margin-bottom: 20px;'>📊 METAR 查询结果</h2></div>")
+
+    def __init__(self, generation, query, downloader):
+        super().__init__()
+        self.generation = generation
+        self.query = query
+        self.downloader = downloader
+        self.parser = METARParser()
+        self.cancelled = False
+        self.chunk_size = self.CHUNK_SIZE
+        self.in_flight = threading.Semaphore(1)
+
+    def cancel(self):
+        self.cancelled = True
+        self.in_flight.release()
+
+    def acknowledge(self, chunk_size=None):
+        if chunk_size:
+            self.chunk_size = max(1, min(chunk_size, self.MAX_CHUNK_SIZE))
+        self.in_flight.release()
+
+    def resolve(self, query):
+        """把查询框内容解析为站点列表；返回 (ICAO 列表, 附加结果行)，无结果时抛出 ValueError"""
+        icao_codes = []
+        conditions = []
+        extra_rows = {}
+        restricted = False
+        for token in (t.strip() for t in query.split(',')):
+            if not token:
+                continue
+            condition = DerivedTable.parse_filter(token)
+            if condition:
+                conditions.append(condition)
+                continue
+            restricted = True
+            # 空间查询 (如 WITHIN 150KM OF ZSPD, NEAREST 5 TO 31.2 121.5)
+            spatial_index = self.downloader.spatial_index
+            nearby = spatial_index.query(token, load_station_table()) if spatial_index else None
+            if nearby is None:
+                icao_codes.append(token)
+                continue
+            for code, distance in nearby:
+                if code not in extra_rows:
+                    icao_codes.append(code)
+                    extra_rows[code] = {'距离': f'{distance:.1f} 公里'}
+
+        # 按派生参数列过滤 (如 CAT<=IFR, RH>90)
+        if conditions:
+            derived = self.downloader.derived
+            if derived is None:
+                raise ValueError("派生参数尚未就绪，请等待数据下载完成")
+            icao_codes = derived.filter(conditions, icao_codes if restricted else None)
+        if not icao_codes:
+            raise ValueError("没有满足条件的站点")
+        return icao_codes, extra_rows
+
+    def render_card(self, code, extra_rows=None):
+        """渲染单个站点的结果卡片，返回 (HTML, 是否成功)"""
+        metar_line = self.downloader.metar_data.get(code)
+
+        # 添加卡片样式的容器
+        card_style = "background: linear-gradient(135deg, #3B4252 0%, #434C5E 100%); border: 1px solid #4C566A; border-radius: 8px; padding: 15px; margin: 10px 0; box-shadow: 0 2px 4px rgba(0,0,0,0.3);"
+        html_content = f"<div style='{card_style}'>"
+
+        if metar_line:
+            # 成功图标和标题
+            html_content += f"<h3 style='color:#A3BE8C; margin: 0 0 10px 0;'>✅ {code} - 查询成功</h3>"
+
+            parsed_data = self.parser.parse(metar_line)
+            derived = self.downloader.derived
+            if derived is not None:
+                parsed_data.update(derived.rows(code))
+            if extra_rows:
+                parsed_data.update(extra_rows)
+
+            # 原始报文
+            html_content += f"<div style='background-color: #2E3440; border-left: 4px solid #A3BE8C; padding: 10px; margin: 10px 0; border-radius: 4px;'>"
+            html_content += f"<p style='font-family: Consolas, monospace; color: #A3BE8C; margin: 0; font-size: 13px;'><strong>原始报文:</strong><br>{parsed_data.get('原始报文', '')}</p>"
+            html_content += "</div>"
+
+            # 解析结果：每行一个段落，名称与数值用制表符对齐到结果区的制表位 (TAB_STOP)，
+            # 数值换行时悬挂缩进。不使用表格：Qt 文档中每个表格都是一个框架，
+            # 追加内容的耗时随文档中已有框架数线性增长，逐批插入上千张卡片时总耗时接近平方级
+            row_style = (f"margin: 0 0 0 {self.TAB_STOP + 8}px; text-indent: -{self.TAB_STOP}px; "
+                         "white-space: pre-wrap; line-height: 160%;")
+            html_content += "<div style='margin-top: 10px;'>"
+            for key, value in parsed_data.items():
+                if key != '原始报文':
+                    # 添加图标
+                    icon = WEATHER_ICONS.get(key, '📋')
+                    html_content += f"<p style='{row_style}'>"
+                    html_content += f"<span style='font-weight: bold; color: #E5E9F0;'>{icon} {key}</span>\t"
+                    html_content += f"<span style='color: #D8DEE9;'>{value}</span></p>"
+            html_content += "</div>"
+        else:
+            # 失败图标和消息
+            html_content += f"<h3 style='color:#BF616A; margin: 0 0 10px 0;'>❌ {code} - 查询失败</h3>"
+            html_content += f"<p style='color:#BF616A; margin: 0;'>未找到代码 {code} 的METAR数据。请检查代码是否正确。</p>"
+
+        html_content += "</div>"
+        return html_content, bool(metar_line)
+
+    def run(self):
+        try:
+            icao_codes, extra_rows = self.resolve(self.query)
+        except ValueError as e:
+            self.query_failed.emit(self.generation, str(e))
+            return
+        self.query_started.emit(self.generation, icao_codes)
+
+        # 第一张卡片单独发送以尽快显示，之后按批发送
+        chunk, successes, failures = [], 0, 0
+        success_count = 0
+        for i, code in enumerate(icao_codes):
+            if self.cancelled:
+                return
+            html, ok = self.render_card(code, extra_rows.get(code))
+            chunk.append(html)
+            successes += ok
+            failures += not ok
+            if i == 0 or len(chunk) >= self.chunk_size or i == len(icao_codes) - 1:
+                fragment = QTextDocumentFragment.fromHtml(''.join(chunk))
+                # 片段内部文档的根框架是惰性创建的 (QObject)。必须在本线程中创建 (toHtml 会创建它)，
+                # 否则界面线程插入片段时才创建，Qt 会报告跨线程创建子对象，根框架也没有父对象而泄漏
+                fragment.toHtml()
+                self.in_flight.acquire()
+                if self.cancelled:
+                    return
+                self.chunk_ready.emit(self.generation, fragment, i + 1, successes, failures)
+                success_count += successes
+                chunk, successes, failures = [], 0, 0
+
+        # 添加总结信息
+        total = len(icao_codes)
+        summary_style = "background: linear-gradient(135deg, #5E81AC 0%, #81A1C1 100%); color: white; padding: 15px; border-radius: 8px; margin: 20px 0; text-align: center;"
+        summary_html = f"<div style='{summary_style}'>"
+        summary_html += f"<h3 style='margin: 0 0 5px 0;'>📈 查询统计</h3>"
+        summary_html += f"<p style='margin: 0;'>成功: {success_count} | 失败: {total - success_count} | 总计: {total} | 成功率: {(success_count/total*100):.1f}%</p>"
+        summary_html += "</div>"
+        if not self.cancelled:
+            self.query_finished.emit(self.generation, icao_codes, success_count, summary_html)
+
+# --- 后台下载线程 (使用同步请求) ---
+class DownloaderThread(QThread):
+    log_signal = pyqtSignal(str)
+    update_complete_signal = pyqtSignal(int)
+    # 本周期变化站点的 {站点: 报文} 及其所属的派生参数表，界面按这份快照评估告警，不读取可能已被下一周期改写的属性
+    stations_changed_signal = pyqtSignal(object, object)
+    connection_signal = pyqtSignal(str)  # 'online' / 'degraded' / 'offline'
+    derived = None
+    spatial_index = None
+    changed_stations = []
+    parser = METARParser()
+
+    # 由下载线程自己执行预算回收的子系统
+    MEMORY_SUBSYSTEMS = ('history', 'rolling')
+
+    def __init__(self, source=None, archive_dir=None, memory=None):
+        super().__init__()
+        self.source = source or MetarSource()
+        self.archive_dir = archive_dir
+        self.metar_data = {}
+        self.history = ReportHistory()
+        self.rolling = RollingStatistics()
+        self.memory = memory or MemoryAccountant()
+        self.memory.register('metar_data', lambda: MemoryAccountant.sizeof_strings(self.metar_data))
+        self.memory.register('history', lambda: self.history.nbytes, self.history.trim)
+        self.memory.register('derived', lambda: MemoryAccountant.sizeof_arrays(self.derived))
+        self.memory.register('rolling', self.rolling.nbytes, self.rolling.trim)
+
+    def now(self):
+        """数据源时钟的当前时间 (使用替身服务器时钟时需要一次网络请求)"""
+        return self.source.now()
+
+    def run(self):
+        while True:
+            self.download_metar_file()
+            self.check_connection()
+            self.log_signal.emit("60秒后开始下一次下载周期。")
             time.sleep(60)
 
     def download_metar_file(self):
+        """下载并处理当前小时的周期文件，返回其中的报文条数 (失败时为 0)"""
         start_time = datetime.now()
         self.log_signal.emit("开始下载数据......")
+        self.changed_stations = []
+        count = 0
         try:
-            utc_time = datetime.utcnow().replace(tzinfo=pytz.utc)
+            utc_time = self.source.now()
             file_name = f"{utc_time.hour:02d}Z.TXT"
             self.log_signal.emit(f"尝试下载文件: {file_name}")
-            url = f"https://tgftp.nws.noaa.gov/data/observations/metar/cycles/{file_name}"
-            response = requests.get(url, timeout=15)
-            response.raise_for_status()
-            raw_data = response.text
+            raw_data = self.source.fetch_cycle(utc_time.hour)
+            self.archive_cycle(utc_time, file_name, raw_data)
             lines = raw_data.split('\n')
             pattern = re.compile(r"^[A-Z]{4} ")
             metar_lines = [line for line in lines if pattern.match(line) and len(line.split()) > 1]
+            changed = {}
             for line in metar_lines:
                 station = line.split()[0]
-                self.metar_data[station] = line
-            self.update_complete_signal.emit(len(metar_lines))
+                self.history.add(station, line, utc_time)
+                if self.metar_data.get(station) != line:
+                    self.metar_data[station] = line
+                    changed[station] = True
+            self.history.expire(utc_time)
+            self.changed_stations = list(changed)
+            # 新表填入滚动统计列后才发布，查询线程不会看到滚动统计列仍为 NaN 的表
+            derived = self.compute_derived()
+            self.rolling.ingest(self.changed_stations, self.metar_data, derived, utc_time)
+            self.rolling.expire(utc_time)
+            for result in self.memory.enforce(self.MEMORY_SUBSYSTEMS):
+                self.log_signal.emit(self.memory.describe_enforcement(*result))
+            derived.attach_rolling(self.rolling)
+            self.derived = derived
+            self.spatial_index = StationIndex(load_station_table(), list(self.metar_data))
+            count = len(metar_lines)
+            self.stations_changed_signal.emit({s: self.metar_data[s] for s in self.changed_stations}, derived)
+            self.update_complete_signal.emit(count)
             self.log_signal.emit("本地数据缓存已更新。")
+            if self.source.hedger is not None:
+                self.log_signal.emit(self.source.hedger.describe())
         except Exception as e:
             self.log_signal.emit(f"下载错误: {e}")
         finally:
             elapsed = (datetime.now() - start_time).total_seconds()
             self.log_signal.emit(f"本次下载周期完成，耗时: {elapsed:.2f} 秒。")
+        return count
+
+    def check_connection(self):
+        """探测数据源是否可达，结果通过 connection_signal 报告给界面"""
+        try:
+            response = requests.get(self.source.status_url(), timeout=3)
+            self.connection_signal.emit('online' if response.status_code == 200 else 'degraded')
+        except requests.exceptions.RequestException:
+            self.connection_signal.emit('offline')
+
+    def archive_cycle(self, utc_time, file_name, raw_data):
+        """把下载的周期文件保存到归档目录 (YYYYMMDD/cycles/HHZ.TXT)，供回放使用"""
+        if not self.archive_dir:
+            return
+        directory = os.path.join(self.archive_dir, utc_time.strftime('%Y%m%d'), 'cycles')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as f:
+            f.write(raw_data)
+
+    def compute_derived(self):
+        """对全部缓存站点批量计算派生参数，返回新表 (由调用方在填入滚动统计后发布)"""
+        start = time.perf_counter()
+        derived = DerivedTable.compute(self.metar_data, self.parser, load_station_table())
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.log_signal.emit(f"派生参数计算完成: {len(derived)} 个站点，耗时 {elapsed_ms:.0f} 毫秒。")
+        return derived
+
+# --- 共享缓存 (守护进程发布，多个实例只读附加) ---
+def default_shared_dir():
+    """每个用户独立的段文件目录：优先使用 XDG_RUNTIME_DIR，否则在临时目录下以用户编号区分"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'metar_finder_cache')
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), f'metar_finder_cache-{user}')
+
+SHARED_CACHE_DIR = default_shared_dir()
+
+def check_shared_dir(directory, create=False):
+    """确认段文件目录是当前用户所有、只有本人可写的真实目录 (不是符号链接)，
+    否则其他本地用户可以替换段文件或预置符号链接；create=True 时按 0700 权限创建"""
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"共享缓存目录不是普通目录: {directory}")
+    if hasattr(os, 'getuid'):  # Windows 没有 POSIX 属主和权限位
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"共享缓存目录不属于当前用户: {directory}")
+        if info.st_mode & 0o077:
+            raise PermissionError(f"共享缓存目录的权限过宽 ({stat.S_IMODE(info.st_mode):o})，应为 700: {directory}")
+
+class SharedCacheWriter:
+    """守护进程端：每次下载后把解码好的缓存写成带版本号的段文件 (cache.<版本>.seg)，
+    再原子地替换 current 指针文件。段内依次为按站点排序的索引、基础数值列、滚动统计列、跑道对、原始报文，
+    以及守护进程报文历史的紧凑存储 (站点代码、块表、站点编号、观测分钟、压缩报文)。
+    附加的实例直接使用守护进程算好的滚动统计，按小时导出历史时读取段中的历史"""
+    MAGIC = b'METARSHM'
+    FORMAT = 3
+    # 魔数, 格式, 站点数, 跑道数, 历史站点数/块数/报文数, 版本, 发布时间, 数据源时钟相对本机时间的偏移 (秒),
+    # 索引/数值列/滚动统计/跑道站点/跑道名/报文/历史站点/块表/站点编号/观测分钟/压缩报文 十一个区段的偏移
+    HEADER = struct.Struct('<8sIIIIIIQdd11Q')
+    HEADER_SIZE = 144
+    INDEX_DTYPE = np.dtype([('station', 'S4'), ('offset', '<u4'), ('length', '<u4'), ('changed', '<u8')])
+    POINTER_FILE = 'current'
+
+    def __init__(self, directory=SHARED_CACHE_DIR, keep=3):
+        self.directory = directory
+        self.keep = keep
+        check_shared_dir(directory, create=True)
+        self.version = max(self.segment_versions(directory), default=0)
+        self.changed_version = {}
+
+    @staticmethod
+    def segment_versions(directory):
+        versions = []
+        for name in os.listdir(directory):
+            match = re.match(r'^cache\.(\d+)\.seg$', name)
+            if match:
+                versions.append(int(match.group(1)))
+        return versions
+
+    @staticmethod
+    def segment_path(directory, version):
+        return os.path.join(directory, f'cache.{version}.seg')
+
+    def publish(self, metar_data, derived, changed_stations=None, history=None, now=None):
+        """写出新版本的段文件并切换指针，返回 (版本号, 段文件字节数)；now 为数据源时钟的当前时间"""
+        self.version += 1
+        stations = derived.stations
+        for station in (stations if changed_stations is None else changed_stations):
+            self.changed_version[station] = self.version
+
+        n = len(stations)
+        order = np.argsort(np.array(stations, dtype='S4'), kind='stable')
+        sorted_stations = [stations[i] for i in order]
+        blobs = [metar_data[s].encode('utf-8') for s in sorted_stations]
+        index = np.zeros(n, dtype=self.INDEX_DTYPE)
+        index['station'] = sorted_stations
+        index['length'] = [len(b) for b in blobs]
+        index['offset'] = np.cumsum(index['length']) - index['length']
+        index['changed'] = [self.changed_version.get(s, self.version) for s in sorted_stations]
+        columns = np.array([getattr(derived, key)[order] for key in DerivedTable.BASE_COLUMNS], dtype=np.float64)
+        rolling = np.array([getattr(derived, key)[order] for key in DerivedTable.ROLLING_COLUMNS], dtype=np.float64)
+
+        # 跑道对的站点下标换成排序后的位置，并保持按站点有序 (rows() 依赖 searchsorted)
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        rw_station = position[derived.rw_station]
+        rw_order = np.argsort(rw_station, kind='stable')
+        rw_names = np.array(derived.rw_names, dtype='S4')[rw_order]
+        rw_station = rw_station[rw_order]
+
+        store = history.store if history is not None else CompactReportStore()
+        names, table, history_stations, history_minutes, history_text = store.to_buffers()
+
+        sections = [index.tobytes(), columns.tobytes(), rolling.tobytes(), rw_station.tobytes(), rw_names.tobytes(),
+                    b''.join(blobs), names.tobytes(), table.tobytes(), history_stations.tobytes(),
+                    history_minutes.tobytes(), history_text]
+        offsets = []
+        cursor = self.HEADER_SIZE
+        for section in sections:
+            offsets.append(cursor)
+            cursor = (cursor + len(section) + 7) // 8 * 8
+        published = time.time()
+        clock_offset = now.timestamp() - published if now is not None else 0.0
+        header = self.HEADER.pack(self.MAGIC, self.FORMAT, n, len(rw_station), len(names), len(table),
+                                  len(history_stations), self.version, published, clock_offset, *offsets)
+
+        path = self.segment_path(self.directory, self.version)
+        with self.replacing(path) as f:
+            f.write(header.ljust(self.HEADER_SIZE, b'\0'))
+            for offset, section in zip(offsets, sections):
+                f.seek(offset)
+                f.write(section)
+            f.truncate(cursor)
+        with self.replacing(os.path.join(self.directory, self.POINTER_FILE)) as f:
+            f.write(f'{self.version}\n'.encode('ascii'))
+        self.prune()
+        return self.version, os.path.getsize(path)
+
+    @contextmanager
+    def replacing(self, path):
+        """在目录中用 mkstemp 新建临时文件 (名字不可预测，不跟随符号链接)，写完后原子地替换 path"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def prune(self):
+        """删除旧版本段文件 (保留最近 keep 个，给正在切换的读者留出时间)"""
+        for version in self.segment_versions(self.directory):
+            if version <= self.version - self.keep:
+                try:
+                    os.remove(self.segment_path(self.directory, version))
+                except OSError:  # Windows 下仍被映射的文件无法删除，下次再试
+                    pass
+
+
+class SharedCacheReader(Mapping):
+    """只读映射守护进程发布的段文件：按 ICAO 二分查找报文，数值列直接作为 NumPy 视图使用，
+    不复制整份缓存。接口与 metar_data 字典相同"""
+
+    def __init__(self, directory=SHARED_CACHE_DIR):
+        self.directory = directory
+        self.version = 0
+        self.published_at = None
+        self.clock_offset = timedelta(0)
+        self.history = CompactReportStore()
+        # (映射, 索引, 报文区偏移) 作为一个整体替换，查询线程读取时不会混用新旧版本
+        self.view = (None, np.zeros(0, dtype=SharedCacheWriter.INDEX_DTYPE), 0)
+        self.columns = np.zeros((len(DerivedTable.BASE_COLUMNS), 0))
+        self.rolling = np.zeros((len(DerivedTable.ROLLING_COLUMNS), 0))
+        self.rw_station = np.zeros(0, dtype=np.int64)
+        self.rw_names = np.zeros(0, dtype='S4')
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.directory, SharedCacheWriter.POINTER_FILE), encoding='ascii') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def refresh(self):
+        """有新版本时重新映射段文件，返回是否切换了版本；目录不安全时抛出 PermissionError"""
+        if not os.path.isdir(self.directory):
+            return False
+        check_shared_dir(self.directory)
+        version = self.current_version()
+        if not version or version == self.version:
+            return False
+        with open(SharedCacheWriter.segment_path(self.directory, version), 'rb') as f:
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, fmt, count, rw_count, name_count, block_count, report_count,
+         version, published, clock_offset, *offsets) = SharedCacheWriter.HEADER.unpack_from(segment)
+        if magic != SharedCacheWriter.MAGIC or fmt != SharedCacheWriter.FORMAT:
+            raise ValueError(f"共享缓存段格式不兼容: {magic!r} v{fmt}")
+        (index_offset, columns_offset, rolling_offset, rw_station_offset, rw_names_offset, blob_offset,
+         names_offset, table_offset, stations_offset, minutes_offset, text_offset) = offsets
+        width = len(DerivedTable.BASE_COLUMNS)
+        self.columns = np.frombuffer(segment, np.float64, width * count, columns_offset).reshape(width, count)
+        width = len(DerivedTable.ROLLING_COLUMNS)
+        self.rolling = np.frombuffer(segment, np.float64, width * count, rolling_offset).reshape(width, count)
+        self.rw_station = np.frombuffer(segment, np.int64, rw_count, rw_station_offset)
+        self.rw_names = np.frombuffer(segment, 'S4', rw_count, rw_names_offset)
+        self.history = CompactReportStore.from_buffers(
+            np.frombuffer(segment, 'S4', name_count, names_offset),
+            np.frombuffer(segment, CompactReportStore.BLOCK_DTYPE, block_count, table_offset),
+            np.frombuffer(segment, np.uint16, report_count, stations_offset),
+            np.frombuffer(segment, np.int32, report_count, minutes_offset),
+            memoryview(segment)[text_offset:])
+        self.view = (segment, np.frombuffer(segment, SharedCacheWriter.INDEX_DTYPE, count, index_offset), blob_offset)
+        self.version = version
+        self.published_at = datetime.fromtimestamp(published, pytz.utc)
+        self.clock_offset = timedelta(seconds=clock_offset)
+        return True
+
+    def position(self, station, index):
+        try:
+            key = station.encode('ascii')
+        except (AttributeError, UnicodeEncodeError):
+            return None
+        i = int(np.searchsorted(index['station'], key))
+        if i < len(index) and index['station'][i] == key:
+            return i
+        return None
+
+    def __getitem__(self, station):
+        segment, index, blob_offset = self.view
+        i = self.position(station, index)
+        if i is None:
+            raise KeyError(station)
+        start = blob_offset + int(index['offset'][i])
+        return segment[start:start + int(index['length'][i])].decode('utf-8')
+
+    def __contains__(self, station):
+        return self.position(station, self.view[1]) is not None
+
+    def __iter__(self):
+        return (s.decode('ascii') for s in self.view[1]['station'])
+
+    def __len__(self):
+        return len(self.view[1])
+
+    @property
+    def nbytes(self):
+        """当前映射的段文件大小"""
+        return len(self.view[0]) if self.view[0] is not None else 0
+
+    def changed_since(self, version):
+        """返回在给定版本之后报文有变化的站点"""
+        index = self.view[1]
+        return [s.decode('ascii') for s in index['station'][index['changed'] > version]]
+
+    def derived_table(self):
+        """用段文件中的基础列构建派生参数表 (只做向量计算，不再解析报文)，
+        滚动统计列直接引用守护进程发布的视图"""
+        columns = dict(zip(DerivedTable.BASE_COLUMNS, self.columns))
+        derived = DerivedTable.from_columns(list(self), columns, self.rw_station,
+                                            [name.decode('ascii') for name in self.rw_names])
+        for key, column in zip(DerivedTable.ROLLING_COLUMNS, self.rolling):
+            setattr(derived, key, column)
+        return derived
+
+
+class SharedCacheClient(QThread):
+    """附加到守护进程的共享缓存，提供与 DownloaderThread 相同的信号和属性，但自身不下载；
+    报文历史和滚动统计都直接读取守护进程随段文件发布的数据"""
+    log_signal = pyqtSignal(str)
+    update_complete_signal = pyqtSignal(int)
+    stations_changed_signal = pyqtSignal(object, object)
+    connection_signal = pyqtSignal(str)  # 附加模式下不访问数据源，固定报告 'shared'
+    derived = None
+    spatial_index = None
+    changed_stations = []
+
+    def __init__(self, directory=SHARED_CACHE_DIR, poll_interval=2.0, memory=None):
+        super().__init__()
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.metar_data = SharedCacheReader(directory)
+        self.history = ReportHistory(store=self.metar_data.history)
+        self.waiting = False
+        # 报文缓存、历史和滚动统计在共享段中 (各实例共用同一份页缓存)，只统计不回收
+        self.memory = memory or MemoryAccountant()
+        self.memory.register('shared_cache', lambda: self.metar_data.nbytes)
+        self.memory.register('derived', lambda: MemoryAccountant.sizeof_arrays(self.derived))
+
+    def now(self):
+        """守护进程数据源时钟的当前时间 (按最近一次发布时的偏移推算)"""
+        return datetime.now(pytz.utc) + self.metar_data.clock_offset
+
+    def run(self):
+        self.log_signal.emit(f"附加到共享缓存: {self.directory}")
+        self.connection_signal.emit('shared')
+        while True:
+            self.poll()
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        """检查是否有新版本，有则更新派生参数和空间索引，返回是否更新"""
+        seen = self.metar_data.version
+        try:
+            if not self.metar_data.refresh():
+                if not seen and not self.waiting:
+                    self.waiting = True
+                    self.log_signal.emit("尚未发现共享缓存，等待守护进程发布数据......")
+                return False
+        except (OSError, ValueError) as e:
+            self.log_signal.emit(f"附加共享缓存失败: {e}")
+            return False
+        start = time.perf_counter()
+        self.changed_stations = self.metar_data.changed_since(seen)
+        self.history = ReportHistory(store=self.metar_data.history)
+        self.derived = self.metar_data.derived_table()
+        self.spatial_index = StationIndex(load_station_table(), list(self.metar_data))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.log_signal.emit(f"共享缓存版本 {self.metar_data.version}: {len(self.metar_data)} 个站点，"
+                             f"变化 {len(self.changed_stations)} 个，附加耗时 {elapsed_ms:.0f} 毫秒。")
+        self.stations_changed_signal.emit({s: self.metar_data[s] for s in self.changed_stations}, self.derived)
+        self.update_complete_signal.emit(len(self.metar_data))
+        return True
+
+# --- 本地 NOAA 替身服务器 ---
+class StandInServer:
+    """从归档目录提供 cycles/HHZ.TXT 和 stations/XXXX.TXT 的本地服务器，
+    可模拟网络延迟、服务错误、整点内文件逐步增长以及加速时间"""
+    PATH_PREFIX = '/data/observations/metar'
+
+    def __init__(self, archive_dir, host='127.0.0.1', port=0, clock=None,
+                 latency=0.0, jitter=0.0, error_rate=0.0, grow=False, seed=None):
+        self.days = self.find_archive_days(archive_dir)
+        if not self.days:
+            raise ValueError(f"归档目录中没有 cycles/HHZ.TXT 文件: {archive_dir}")
+        self.clock = clock or SimulatedClock()
+        self.first_date = self.clock.now().date()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.grow = grow
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.blocks_cache = {}
+        self.stats = {'requests': 0, 'errors': 0, 'bytes': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @staticmethod
+    def find_archive_days(archive_dir):
+        """归档可以是单日 (archive/cycles/HHZ.TXT) 或多日 (archive/YYYYMMDD/cycles/HHZ.TXT)"""
+        if os.path.isdir(os.path.join(archive_dir, 'cycles')):
+            return [archive_dir]
+        if not os.path.isdir(archive_dir):
+            return []
+        return [os.path.join(archive_dir, d) for d in sorted(os.listdir(archive_dir))
+                if re.fullmatch(r'\d{8}', d) and os.path.isdir(os.path.join(archive_dir, d, 'cycles'))]
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def current_day(self, now):
+        return self.days[(now.date() - self.first_date).days % len(self.days)]
+
+    def read_blocks(self, path):
+        """读取周期文件并按空行拆成 [时间戳行 + 报文行] 块，结果缓存"""
+        with self.lock:
+            if path not in self.blocks_cache:
+                try:
+                    with open(path, encoding='utf-8', errors='replace') as f:
+                        text = f.read().strip()
+                    self.blocks_cache[path] = [b for b in re.split(r'\n\s*\n', text) if b.strip()]
+                except OSError:
+                    self.blocks_cache[path] = None
+            return self.blocks_cache[path]
+
+    def cycle_blocks(self, hour, now):
+        blocks = self.read_blocks(os.path.join(self.current_day(now), 'cycles', f'{hour:02d}Z.TXT'))
+        if blocks and self.grow and now.hour == hour:
+            # 当前小时的文件随时间增长: 只提供已经"到达"的部分
+            elapsed = now.minute * 60 + now.second
+            blocks = blocks[:max(1, len(blocks) * elapsed // 3600)]
+        return blocks
+
+    def station_text(self, icao_code, now):
+        path = os.path.join(self.current_day(now), 'stations', f'{icao_code}.TXT')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8', errors='replace') as f:
+                return f.read()
+        # 没有单站文件时，从当前小时的周期文件中取该站最新一条
+        for block in reversed(self.cycle_blocks(now.hour, now) or []):
+            if re.search(rf'^{icao_code} ', block, re.MULTILINE):
+                return block + '\n'
+        return None
+
+    def respond(self, path):
+        """返回 (状态码, 正文)"""
+        path = path.split('?')[0]
+        if path.startswith(self.PATH_PREFIX):
+            path = path[len(self.PATH_PREFIX):]
+        # 时钟查询不参与延迟和错误模拟，否则客户端读到的模拟时间会随延迟漂移
+        if path == '/clock':
+            return 200, self.clock.now().isoformat()
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        now = self.clock.now()
+        if self.random.random() < self.error_rate:
+            return 503, 'Service Unavailable'
+
+        cycle_match = re.fullmatch(r'/cycles/(\d{2})Z\.TXT', path)
+        station_match = re.fullmatch(r'/stations/([A-Z0-9]{4})\.TXT', path)
+        if cycle_match:
+            blocks = self.cycle_blocks(int(cycle_match.group(1)), now)
+            if blocks is not None:
+                return 200, '\n\n'.join(blocks) + '\n'
+        elif station_match:
+            text = self.station_text(station_match.group(1), now)
+            if text is not None:
+                return 200, text
+        elif path in ('/stations/', '/stations', '/cycles/', '/cycles'):
+            return 200, 'OK'
+        return 404, 'Not Found'
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, text = server.respond(self.path)
+                body = text.encode('utf-8')
+                with server.lock:
+                    server.stats['requests'] += 1
+                    server.stats['bytes'] += len(body)
+                    if status >= 500:
+                        server.stats['errors'] += 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# --- 回放驱动 ---
+class ReplayDriver:
+    """把归档数据按模拟时钟逐小时推过完整处理流程 (下载→解析→历史→派生参数→空间索引→告警)，统计端到端吞吐量"""
+
+    def __init__(self, archive_dir, polls_per_hour=1, mirrors=0, log=print, **server_options):
+        self.archive_dir = archive_dir
+        self.polls_per_hour = max(1, polls_per_hour)
+        self.mirrors = mirrors
+        self.log = log
+        self.server_options = server_options
+
+    def start_time(self, days):
+        name = os.path.basename(os.path.normpath(days[0]))
+        if re.fullmatch(r'\d{8}', name):
+            return datetime.strptime(name, '%Y%m%d').replace(tzinfo=pytz.utc)
+        return datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def run(self):
+        days = StandInServer.find_archive_days(self.archive_dir)
+        if not days:
+            raise ValueError(f"归档目录中没有 cycles/HHZ.TXT 文件: {self.archive_dir}")
+        start = self.start_time(days)
+        clock = SimulatedClock(start, speed=0)
+        # 额外的替身服务器充当镜像，用于测试对冲请求
+        servers = [StandInServer(self.archive_dir, clock=clock, seed=i, **self.server_options).start()
+                   for i in range(1 + self.mirrors)]
+        source = MetarSource(servers[0].base_url, clock=clock, mirrors=[s.base_url for s in servers[1:]])
+        errors = []
+        try:
+            downloader = DownloaderThread(source)
+            downloader.log_signal.connect(lambda m: errors.append(m) if m.startswith("下载错误") else None)
+            # 回放的是历史数据，不写告警文件，也不调用 alerts.txt 中配置的钩子命令
+            alert_engine = AlertEngine.load(log_path=None, hook=None)
+            cycle_times = []
+            reports = changed = alerts = 0
+            wall_start = time.perf_counter()
+            for day in range(len(days)):
+                for hour in range(24):
+                    for poll in range(self.polls_per_hour):
+                        minute = 59 * (poll + 1) // self.polls_per_hour
+                        clock.set(start + timedelta(days=day, hours=hour, minutes=minute))
+                        cycle_start = time.perf_counter()
+                        reports += downloader.download_metar_file()
+                        changed += len(downloader.changed_stations)
+                        alerts += len(alert_engine.evaluate(
+                            downloader.changed_stations, downloader.metar_data, downloader.derived))
+                        cycle_times.append(time.perf_counter() - cycle_start)
+                self.log(f"回放第 {day + 1}/{len(days)} 天完成，累计 {reports} 条报文。")
+            wall = time.perf_counter() - wall_start
+        finally:
+            for server in servers:
+                server.stop()
+
+        cycle_ms = np.array(cycle_times) * 1000
+        summary = {
+            'days': len(days), 'cycles': len(cycle_times), 'errors': len(errors),
+            'reports': reports, 'changed': changed, 'alerts': alerts,
+            'stations': len(downloader.metar_data), 'history': len(downloader.history),
+            'bytes': sum(server.stats['bytes'] for server in servers), 'wall_seconds': wall,
+            'reports_per_second': reports / wall if wall else 0.0,
+            'cycle_ms_p50': float(np.percentile(cycle_ms, 50)),
+            'cycle_ms_p95': float(np.percentile(cycle_ms, 95)),
+            'cycle_ms_max': float(cycle_ms.max()),
+            'speedup': len(days) * 86400 / wall if wall else 0.0,
+        }
+        self.log(f"回放完成: {summary['days']} 天 / {summary['cycles']} 个下载周期，失败 {summary['errors']} 次")
+        self.log(f"报文 {summary['reports']} 条 (变化 {summary['changed']} 站次，告警 {summary['alerts']} 条)，"
+                 f"传输 {summary['bytes'] / 1e6:.1f} MB")
+        self.log(f"吞吐量 {summary['reports_per_second']:.0f} 条/秒，单周期耗时 p50 {summary['cycle_ms_p50']:.1f} 毫秒 / "
+                 f"p95 {summary['cycle_ms_p95']:.1f} 毫秒 / 最大 {summary['cycle_ms_max']:.1f} 毫秒，"
+                 f"相当于 {summary['speedup']:.0f} 倍速")
+        if source.hedger is not None:
+            summary['hedging'] = source.hedger.report()
+            self.log(source.hedger.describe())
+        return summary
+
+
+# --- 界面卡顿监测 ---
+class EventLoopWatchdog(QObject):
+    """用高频定时器测量 GUI 事件循环延迟；超过阈值的卡顿连同造成卡顿的 Python 调用栈一起记录"""
+    stall_detected = pyqtSignal(float, str)
+
+    def __init__(self, interval_ms=10, threshold_ms=100, max_stalls=100):
+        super().__init__()
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.gui_thread_id = threading.get_ident()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.beat)
+        self.stalls = deque(maxlen=max_stalls)
+        self.latencies = deque(maxlen=10000)
+        self.last_beat = time.perf_counter()
+        self.pending_stack = None
+        self.monitor = None
+        self.running = False
+
+    def start(self):
+        self.reset()
+        self.running = True
+        self.timer.start()
+        self.monitor = threading.Thread(target=self.watch, daemon=True)
+        self.monitor.start()
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def reset(self):
+        self.stalls.clear()
+        self.latencies.clear()
+        self.last_beat = time.perf_counter()
+        self.pending_stack = None
+
+    def beat(self):
+        """GUI 线程中的心跳: 两次心跳间超出定时间隔的部分就是事件循环延迟"""
+        now = time.perf_counter()
+        latency = max(now - self.last_beat - self.interval, 0.0)
+        self.last_beat = now
+        self.latencies.append(latency)
+        if latency >= self.threshold:
+            stack = self.pending_stack or ''
+            self.stalls.append((datetime.now(), latency, stack))
+            self.stall_detected.emit(latency * 1000, stack)
+        self.pending_stack = None
+
+    def watch(self):
+        """监测线程: 心跳超时未到时抓取 GUI 线程当前的调用栈 (每次卡顿只抓一次)"""
+        while self.running:
+            time.sleep(self.threshold / 4)
+            beat = self.last_beat
+            if self.pending_stack is None and time.perf_counter() - beat > self.threshold:
+                frame = sys._current_frames().get(self.gui_thread_id)
+                if frame is not None and beat == self.last_beat:
+                    self.pending_stack = ''.join(traceback.format_stack(frame))
+
+    def summary(self):
+        """返回当前统计: 最大/p99 延迟 (毫秒) 和卡顿次数"""
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'max_ms': float(latencies.max()),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'stalls': len(self.stalls),
+            'samples': len(self.latencies),
+        }
+
+    @staticmethod
+    def culprit(stack):
+        """从调用栈中取出最内层的本程序帧，作为简短描述"""
+        frames = re.findall(r'File "([^"]+)", line (\d+), in (\S+)', stack)
+        own = [f for f in frames if os.path.basename(f[0]) == os.path.basename(__file__)] or frames
+        if not own:
+            return "未知位置"
+        path, line, function = own[-1]
+        return f"{function} ({os.path.basename(path)}:{line})"
+
 
 # --- 主窗口 ---
 class MetarApp(QMainWindow):
-    def __init__(self):
+    search_finished = pyqtSignal()
+
+    MEMORY_SUBSYSTEMS = ('query_history', 'log_text', 'result_text')
+    CONNECTION_STATES = {
+        'online': ("🟢 在线", "#A3BE8C"),
+        'degraded': ("🟡 连接异常", "#EBCB8B"),
+        'offline': ("🔴 离线", "#BF616A"),
+        'shared': ("🔗 共享缓存", "#88C0D0"),
+    }
+
+    def __init__(self, source=None, archive_dir=None, start_background=True, stall_threshold_ms=100,
+                 attach_dir=None, budgets=None):
         super().__init__()
+        self.source = source or MetarSource()
+        self.archive_dir = archive_dir
+        self.attach_dir = attach_dir
+        self.memory = MemoryAccountant(budgets)
         self.setWindowTitle("METAR 实时解析工具")
         self.setGeometry(100, 100, 1200, 800)
         self.setStyleSheet(STYLESHEET)
         self.parser = METARParser()
+        self.search_generation = 0
+        self.query_threads = []
+        self.insert_timings = deque(maxlen=16)  # 最近几批结果卡片的 (卡片数, 插入耗时)，用于确定批次大小
         self.init_ui()
-        self.start_downloader()
+        self.load_alert_rules()
+        self.start_watchdog(stall_threshold_ms)
+        self.start_downloader(start_background)
+        self.start_memory_monitor()
 
     def init_ui(self):
         central_widget = QWidget()
@@ -605,7 +3197,7 @@ class MetarApp(QMainWindow):
         # 第一行：输入和按钮
         first_row = QHBoxLayout()
         self.search_entry = QLineEdit()
-        self.search_entry.setPlaceholderText("输入ICAO代码 (多个用逗号隔开)...")
+        self.search_entry.setPlaceholderText("输入ICAO代码 (多个用逗号隔开)、过滤条件 (如 CAT<=IFR) 或空间查询 (如 WITHIN 150KM OF ZSPD)...")
         self.search_entry.returnPressed.connect(self.search_metar)
         search_button = QPushButton("🔍 查询 METAR")
         search_button.setStyleSheet("""
@@ -646,6 +3238,15 @@ class MetarApp(QMainWindow):
         
         second_row.addWidget(self.save_history_check)
         second_row.addStretch()
+        self.export_source_combo = QComboBox()
+        self.export_source_combo.addItem("当前缓存", None)
+        for hours in (1, 6, 24):
+            self.export_source_combo.addItem(f"最近 {hours} 小时历史", hours)
+        export_button = QPushButton("📤 导出数据")
+        export_button.clicked.connect(self.export_data)
+        second_row.addWidget(QLabel("导出:"))
+        second_row.addWidget(self.export_source_combo)
+        second_row.addWidget(export_button)
         search_layout.addLayout(second_row)
         
         # 进度条
@@ -680,6 +3281,8 @@ class MetarApp(QMainWindow):
         result_layout = QVBoxLayout()
         self.result_text = QTextEdit()
         self.result_text.setReadOnly(True)
+        self.result_text.setUndoRedoEnabled(False)  # 只读区域不需要撤销栈，否则插入的每批结果都会在其中再存一份
+        self.result_text.setTabStopDistance(QueryThread.TAB_STOP)
         result_layout.addWidget(self.result_text)
         result_tab.setLayout(result_layout)
         self.tab_widget.addTab(result_tab, "📋 详细结果")
@@ -730,9 +3333,6 @@ class MetarApp(QMainWindow):
         self.time_timer.timeout.connect(self.update_time)
         self.time_timer.start(1000)  # 每秒更新
         
-        # 初始化时更新连接状态
-        self.update_connection_status()
-        
         # 历史记录
         self.query_history = []
         
@@ -763,45 +3363,132 @@ class MetarApp(QMainWindow):
         current_time = datetime.now().strftime("%H:%M:%S")
         self.time_label.setText(f"⏰ {current_time}")
         
-    def update_connection_status(self):
-        """更新连接状态"""
-        try:
-            # 简单的网络连接测试
-            response = requests.get("https://tgftp.nws.noaa.gov/data/observations/metar/stations/", timeout=3)
-            if response.status_code == 200:
-                self.connection_status.setText("🟢 在线")
-                self.connection_status.setStyleSheet("color: #A3BE8C; font-weight: bold;")
-            else:
-                self.connection_status.setText("🟡 连接异常")
-                self.connection_status.setStyleSheet("color: #EBCB8B; font-weight: bold;")
-        except:
-            self.connection_status.setText("🔴 离线")
-            self.connection_status.setStyleSheet("color: #BF616A; font-weight: bold;")
+    def update_connection_status(self, status):
+        """更新连接状态 (由下载线程探测后通过信号报告，界面线程不做网络请求)"""
+        text, color = self.CONNECTION_STATES[status]
+        self.connection_status.setText(text)
+        self.connection_status.setStyleSheet(f"color: {color}; font-weight: bold;")
             
     def update_data_count(self, count):
         """更新数据计数显示"""
         self.data_count_label.setText(f"📊 数据: {count} 条")
 
-    def start_downloader(self):
-        self.downloader = DownloaderThread()
+    def start_downloader(self, start=True):
+        if self.attach_dir:
+            # 附加到守护进程的共享缓存，本实例不再自行下载
+            self.downloader = SharedCacheClient(self.attach_dir, memory=self.memory)
+        else:
+            self.downloader = DownloaderThread(self.source, self.archive_dir, memory=self.memory)
         self.downloader.log_signal.connect(self.update_log)
         self.downloader.update_complete_signal.connect(self.on_update_complete)
-        self.downloader.start()
-        self.status_bar.showMessage("正在启动后台下载...")
+        self.downloader.stations_changed_signal.connect(self.evaluate_alerts)
+        self.downloader.connection_signal.connect(self.update_connection_status)
+        if start:
+            self.downloader.start()
+            self.status_bar.showMessage("正在附加共享缓存..." if self.attach_dir else "正在启动后台下载...")
+
+    def start_watchdog(self, threshold_ms):
+        """启动事件循环卡顿监测，卡顿记录写入系统日志"""
+        self.watchdog = EventLoopWatchdog(threshold_ms=threshold_ms)
+        self.watchdog.stall_detected.connect(self.on_stall_detected)
+        self.watchdog.start()
+
+    def start_memory_monitor(self, interval_ms=10000):
+        """登记界面持有的数据，定时刷新内存统计并执行界面侧的预算回收"""
+        self.memory.register('query_history', lambda: MemoryAccountant.sizeof_strings(self.query_history),
+                             self.trim_query_history)
+        self.memory.register('log_text', lambda: self.document_size(self.log_text),
+                             lambda budget: self.trim_document(self.log_text, budget))
+        self.memory.register('result_text', lambda: self.document_size(self.result_text),
+                             lambda budget: self.trim_document(self.result_text, budget))
+        self.memory_timer = QTimer()
+        self.memory_timer.timeout.connect(self.update_memory_usage)
+        self.memory_timer.start(interval_ms)
+        self.update_memory_usage()
+
+    def update_memory_usage(self):
+        for result in self.memory.enforce(self.MEMORY_SUBSYSTEMS):
+            self.update_log(self.memory.describe_enforcement(*result))
+        report = self.memory.report()
+        self.stats_panel.update_memory(report, self.memory.describe(report))
+
+    @staticmethod
+    def document_size(text_edit):
+        """Qt 文本文档按 UTF-16 字符数估算 (不含排版缓存)"""
+        return text_edit.document().characterCount() * 2
+
+    @staticmethod
+    def trim_document(text_edit, max_bytes):
+        """从文档开头删除整段内容，直到低于预算的 80%"""
+        document = text_edit.document()
+        excess = document.characterCount() - int(max_bytes * 0.8) // 2
+        block = document.begin()
+        end = 0
+        while block.isValid() and end < excess:
+            end = block.position() + block.length()
+            block = block.next()
+        cursor = QTextCursor(document)
+        cursor.setPosition(min(end, document.characterCount() - 1), QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+
+    def trim_query_history(self, max_bytes):
+        """丢弃最早的查询历史，直到低于预算的 80%"""
+        while self.query_history and MemoryAccountant.sizeof_strings(self.query_history) > max_bytes * 0.8:
+            del self.query_history[:max(1, len(self.query_history) // 10)]
+        self.update_history_display()
+
+    def on_stall_detected(self, duration_ms, stack):
+        location = EventLoopWatchdog.culprit(stack) if stack else "未捕获到调用栈"
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.log_text.append(f"[{timestamp}] 界面卡顿 {duration_ms:.0f} 毫秒，位于 {location}")
 
     def update_log(self, message):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.log_text.append(f"[{timestamp}] {message}")
         self.status_bar.showMessage(message, 5000)
 
+    def load_alert_rules(self):
+        """加载告警规则文件"""
+        try:
+            self.alert_engine = AlertEngine.load()
+        except ValueError as e:
+            self.alert_engine = AlertEngine()
+            self.update_log(f"告警规则加载失败: {e}")
+            return
+        if len(self.alert_engine):
+            self.update_log(f"已加载 {len(self.alert_engine)} 条告警规则。")
+
     def on_update_complete(self, count):
         self.status_bar.showMessage(f"数据缓存已更新，共 {count} 条记录。", 10000)
         self.update_data_count(count)
-        self.update_connection_status()
         # 切换到日志选项卡显示更新信息
         if hasattr(self, 'tab_widget'):
             self.tab_widget.setCurrentIndex(1)  # 切换到日志选项卡
 
+    def evaluate_alerts(self, changed_reports, derived):
+        """只对本周期报文有变化的站点评估告警规则 (报文和派生参数表都来自信号携带的同一周期快照)"""
+        alerts = self.alert_engine.evaluate(list(changed_reports), changed_reports, derived)
+        for station, rule, line in alerts:
+            self.update_log(f"⚠️ 告警: {station} 触发规则 {rule.text} — {line}")
+        if alerts:
+            station, rule, _ = alerts[-1]
+            self.status_bar.showMessage(f"⚠️ {len(alerts)} 条新告警，最新: {station} {rule.text}", 30000)
+
+    def export_data(self):
+        """把当前缓存或历史报文导出到文件 (在后台线程中流式写出)"""
+        if getattr(self, 'export_thread', None) and self.export_thread.isRunning():
+            self.status_bar.showMessage("上一次导出尚未完成", 5000)
+            return
+        path, _ = QFileDialog.getSaveFileName(
+            self, "导出数据", "metar_export.csv",
+            "CSV (*.csv);;JSON Lines (*.jsonl);;Parquet (*.parquet);;Arrow (*.arrow)")
+        if not path:
+            return
+        self.export_thread = ExportThread(self.downloader, path, self.export_source_combo.currentData())
+        self.export_thread.log_signal.connect(self.update_log)
+        self.export_thread.start()
+        self.status_bar.showMessage(f"正在导出到 {path} ...")
+
     def clear_results(self):
         """清空所有结果显示区域"""
         self.result_text.clear()
@@ -819,43 +3506,97 @@ class MetarApp(QMainWindow):
             self.status_bar.showMessage("请输入ICAO代码", 5000)
             return
 
-        icao_codes = [code.strip() for code in query.split(',')]
-        
-        # 显示进度条和状态
+        # 新查询使仍在进行的旧查询作废
+        self.search_generation += 1
+        self.reap_query_threads()
+        for thread in self.query_threads:
+            thread.cancel()
+        thread = QueryThread(self.search_generation, query, self.downloader)
+        thread.query_started.connect(self.on_query_started)
+        thread.chunk_ready.connect(self.on_query_chunk)
+        thread.query_finished.connect(self.on_query_finished)
+        thread.query_failed.connect(self.on_query_failed)
+        # finished 在线程真正退出前发出，此时释放引用会在线程仍在运行时销毁 QThread；
+        # 因此只释放 isFinished() 已为真的线程，其余留到下一次清理
+        thread.finished.connect(self.reap_query_threads)
+        self.query_threads.append(thread)
+        self.search_started_at = time.perf_counter()
+        self.first_result_at = None
+
+        # 显示进度条和状态 (站点数未知前显示忙碌状态)
         self.progress_bar.setVisible(True)
+        self.progress_bar.setRange(0, 0)
+        self.status_bar.showMessage("正在查询...")
+        thread.start()
+
+    def reap_query_threads(self):
+        self.query_threads = [t for t in self.query_threads if not t.isFinished()]
+
+    def on_query_started(self, generation, icao_codes):
+        if generation != self.search_generation:
+            return
         self.progress_bar.setRange(0, len(icao_codes))
         self.progress_bar.setValue(0)
-        self.progress_bar.setFormat(f"准备查询 {len(icao_codes)} 个机场... %p%")
-        
-        # 禁用搜索按钮防止重复点击
-        if hasattr(self, 'search_button'):
-            self.search_button.setEnabled(False)
-            self.search_button.setText("🔄 查询中...")
-        
+        self.progress_bar.setFormat(f"正在查询 {len(icao_codes)} 个机场... %p%")
         self.status_bar.showMessage(f"正在查询 {len(icao_codes)} 个机场的METAR数据...")
-        
-        # 强制刷新界面
-        QApplication.processEvents()
-        
-        try:
-            # 添加到历史记录
-            if self.save_history_check.isChecked():
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                history_entry = f"[{timestamp}] 查询: {', '.join(icao_codes)}"
-                self.query_history.append(history_entry)
-                self.update_history_display()
-            
-            self.display_metar(icao_codes)
-            
-        except Exception as e:
-            self.status_bar.showMessage(f"查询失败: {str(e)}", 5000)
-        
-        finally:
-            # 恢复界面状态
-            self.progress_bar.setVisible(False)
-            if hasattr(self, 'search_button'):
-                self.search_button.setEnabled(True)
-                self.search_button.setText("🔍 查询 METAR")
+        self.result_text.setHtml(QueryThread.HEADER_HTML)
+
+        # 添加到历史记录
+        if self.save_history_check.isChecked():
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            history_entry = f"[{timestamp}] 查询: {', '.join(icao_codes)}"
+            self.query_history.append(history_entry)
+            self.update_history_display()
+
+    def on_query_chunk(self, generation, fragment, done, successes, failures):
+        """把工作线程解析好的一批卡片追加到结果区；插入后的重新布局和绘制在事件循环中进行，
+        等这些事件处理完再确认该批，并按实测耗时调整下一批的大小，使每批远低于卡顿阈值"""
+        if generation != self.search_generation:
+            return
+        if self.first_result_at is None:
+            self.first_result_at = time.perf_counter()
+        start = time.perf_counter()
+        cursor = self.result_text.textCursor()
+        cursor.movePosition(cursor.MoveOperation.End)
+        cursor.insertFragment(fragment)
+        self.progress_bar.setValue(done)
+        self.stats_panel.add_requests(successes, failures)
+        QTimer.singleShot(0, lambda: self.on_query_chunk_settled(generation, start, successes + failures))
+
+    def on_query_chunk_settled(self, generation, start, cards):
+        # 每批耗时近似为 固定开销 + 卡片数 x 单卡耗时，用最近几批的实测值拟合
+        self.insert_timings.append((cards, (time.perf_counter() - start) * 1000))
+        sizes, costs = zip(*self.insert_timings)
+        if len(set(sizes)) > 1:
+            per_card, overhead = np.polyfit(sizes, costs, 1)
+        else:
+            per_card, overhead = sum(costs) / sum(sizes), 0.0
+        budget = self.watchdog.threshold * 1000 * 0.3
+        chunk_size = int((budget - max(overhead, 0.0)) / max(per_card, 0.1))
+        for thread in self.query_threads:
+            if thread.generation == generation:
+                thread.acknowledge(max(chunk_size, 1))
+
+    def on_query_finished(self, generation, icao_codes, success_count, summary_html):
+        if generation != self.search_generation:
+            return
+        cursor = self.result_text.textCursor()
+        cursor.movePosition(cursor.MoveOperation.End)
+        cursor.insertHtml(summary_html)
+        self.progress_bar.setVisible(False)
+        self.status_bar.showMessage(f"查询完成: {success_count}/{len(icao_codes)} 成功", 5000)
+
+        # 记录到日志
+        log_entry = f"[{datetime.now().strftime('%H:%M:%S')}] 查询完成: {', '.join(icao_codes)} - 成功率 {(success_count/len(icao_codes)*100):.1f}%"
+        self.log_text.append(log_entry)
+        self.search_finished.emit()
+
+    def on_query_failed(self, generation, message):
+        if generation != self.search_generation:
+            return
+        self.progress_bar.setVisible(False)
+        self.status_bar.showMessage(message, 5000)
+        self.search_finished.emit()
 
     def update_history_display(self):
         """更新历史记录显示"""
@@ -864,103 +3605,441 @@ class MetarApp(QMainWindow):
             history_html += f"<p style='color:#D8DEE9; margin: 5px 0;'>{entry}</p>"
         self.history_text.setHtml(history_html)
 
-    def display_metar(self, icao_codes):
-        html_content = "<div style='font-family: Segoe UI, Arial, sans-serif;'>"
-        html_content += f"<h2 style='color:#88C0D0; text-align: center; margin-bottom: 20px;'>📊 METAR 查询结果</h2>"
-        success_count = 0
-        
-        for i, code in enumerate(icao_codes):
-            # 更新进度条
-            if hasattr(self, 'progress_bar') and self.progress_bar.isVisible():
-                self.progress_bar.setValue(i)
-                QApplication.processEvents()  # 刷新界面
-            
-            metar_line = self.downloader.metar_data.get(code)
-            
-            # 添加卡片样式的容器
-            card_style = "background: linear-gradient(135deg, #3B4252 0%, #434C5E 100%); border: 1px solid #4C566A; border-radius: 8px; padding: 15px; margin: 10px 0; box-shadow: 0 2px 4px rgba(0,0,0,0.3);"
-            html_content += f"<div style='{card_style}'>"
-            
-            if metar_line:
-                success_count += 1
-                # 成功图标和标题
-                html_content += f"<h3 style='color:#A3BE8C; margin: 0 0 10px 0;'>✅ {code} - 查询成功</h3>"
-                
-                parsed_data = self.parser.parse(metar_line)
-                
-                # 原始报文
-                html_content += f"<div style='background-color: #2E3440; border-left: 4px solid #A3BE8C; padding: 10px; margin: 10px 0; border-radius: 4px;'>"
-                html_content += f"<p style='font-family: Consolas, monospace; color: #A3BE8C; margin: 0; font-size: 13px;'><strong>原始报文:</strong><br>{parsed_data.get('原始报文', '')}</p>"
-                html_content += "</div>"
-                
-                # 解析结果表格
-                html_content += "<table style='width: 100%; border-collapse: collapse; margin-top: 10px;'>"
-                for key, value in parsed_data.items():
-                    if key != '原始报文':
-                        # 添加图标
-                        icon = self.get_weather_icon(key)
-                        html_content += f"<tr style='border-bottom: 1px solid #4C566A;'>"
-                        html_content += f"<td style='padding: 8px; font-weight: bold; color: #E5E9F0; width: 180px;'>{icon} {key}</td>"
-                        html_content += f"<td style='padding: 8px; color: #D8DEE9;'>{value}</td></tr>"
-                html_content += "</table>"
-                
-                self.stats_panel.add_request(success=True)
-            else:
-                # 失败图标和消息
-                html_content += f"<h3 style='color:#BF616A; margin: 0 0 10px 0;'>❌ {code} - 查询失败</h3>"
-                html_content += f"<p style='color:#BF616A; margin: 0;'>未找到代码 {code} 的METAR数据。请检查代码是否正确。</p>"
-                self.stats_panel.add_request(success=False)
-            
-            html_content += "</div>"
-            
-            # 最终更新进度条
-            if hasattr(self, 'progress_bar') and self.progress_bar.isVisible():
-                self.progress_bar.setValue(i + 1)
-                QApplication.processEvents()
-        
-        # 添加总结信息
-        summary_style = "background: linear-gradient(135deg, #5E81AC 0%, #81A1C1 100%); color: white; padding: 15px; border-radius: 8px; margin: 20px 0; text-align: center;"
-        html_content += f"<div style='{summary_style}'>"
-        html_content += f"<h3 style='margin: 0 0 5px 0;'>📈 查询统计</h3>"
-        html_content += f"<p style='margin: 0;'>成功: {success_count} | 失败: {len(icao_codes) - success_count} | 总计: {len(icao_codes)} | 成功率: {(success_count/len(icao_codes)*100):.1f}%</p>"
-        html_content += "</div>"
-        
-        html_content += "</div>"
-        
-        self.result_text.setHtml(html_content)
-        self.status_bar.showMessage(f"查询完成: {success_count}/{len(icao_codes)} 成功", 5000)
-        
-        # 记录到日志
-        log_entry = f"[{datetime.now().strftime('%H:%M:%S')}] 查询完成: {', '.join(icao_codes)} - 成功率 {(success_count/len(icao_codes)*100):.1f}%"
-        self.log_text.append(log_entry)
-        
-
-        
     def get_weather_icon(self, key):
         """根据天气要素返回对应的图标"""
-        icons = {
-            '场站': '🛩️',
-            '观测时间': '🕐',
-            '风': '💨',
-            '能见度': '👁️',
-            '天气现象': '🌦️',
-            '云况': '☁️',
-            '温度/露点': '🌡️',
-            '气压': '📊',
-            '跑道视程': '🛬',
-            '趋势预报': '📈',
-            '近期天气': '🌧️',
-            '风切变': '💨',
-            '备注': '📝'
-        }
-        return icons.get(key, '📋')
-     
+        return WEATHER_ICONS.get(key, '📋')
+
+
+# --- 命令行 (无界面) 入口 ---
+def log_to_console(message):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="METAR 实时解析工具")
+    parser.add_argument('--headless', action='store_true', help="不启动图形界面，下载一次数据后执行命令行操作")
+    parser.add_argument('--export', metavar='PATH', help="导出数据到文件 (.csv / .jsonl / .parquet / .arrow)")
+    parser.add_argument('--format', choices=sorted(set(ReportExporter.FORMATS.values())), help="导出格式 (默认按扩展名)")
+    parser.add_argument('--since', type=float, metavar='HOURS', help="导出守护进程保存的最近 N 小时历史报文 (需与 --attach 一起使用，默认导出当前缓存)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="导出时每个数据块的报文条数")
+    parser.add_argument('--source', metavar='URL', default=NOAA_BASE_URL, help="数据源地址 (默认 NOAA，可指向本地替身服务器)")
+    parser.add_argument('--mirror', metavar='URL', action='append', default=[], help="周期文件的备用镜像 (可重复)，配置后启用对冲请求")
+    parser.add_argument('--server-clock', action='store_true', help="使用数据源 /clock 提供的模拟时间 (配合加速的替身服务器)")
+    parser.add_argument('--archive', metavar='DIR', help="把下载的周期文件保存到归档目录，供回放使用")
+
+    standin = parser.add_argument_group("替身服务器与回放")
+    standin.add_argument('--serve', metavar='ARCHIVE', help="启动本地 NOAA 替身服务器，提供归档目录中的数据")
+    standin.add_argument('--replay', metavar='ARCHIVE', help="把归档数据推过完整处理流程并统计吞吐量")
+    standin.add_argument('--port', type=int, default=8080, help="替身服务器端口")
+    standin.add_argument('--latency', type=float, default=0.0, help="每个请求的固定延迟 (秒)")
+    standin.add_argument('--jitter', type=float, default=0.0, help="每个请求额外的随机延迟上限 (秒)")
+    standin.add_argument('--error-rate', type=float, default=0.0, help="返回 503 错误的概率")
+    standin.add_argument('--grow', action='store_true', help="模拟当前小时的周期文件随时间增长")
+    standin.add_argument('--speed', type=float, default=1.0, help="替身服务器时钟加速倍数")
+    standin.add_argument('--start', metavar='YYYY-MM-DDTHH:MM', help="替身服务器时钟起始时间 (UTC，默认当前时间)")
+    standin.add_argument('--polls-per-hour', type=int, default=1, help="回放时每小时的下载次数")
+    standin.add_argument('--replay-mirrors', type=int, default=0, help="回放时额外启动的镜像替身服务器数量 (测试对冲请求)")
+
+    shared = parser.add_argument_group("共享缓存")
+    shared.add_argument('--daemon', action='store_true', help="以守护进程运行：负责下载并把缓存发布到共享段文件")
+    shared.add_argument('--attach', action='store_true', help="附加到守护进程的共享缓存 (只读)，不自行下载")
+    shared.add_argument('--shared-dir', metavar='DIR', default=SHARED_CACHE_DIR, help="共享缓存段文件所在目录")
+
+    memory = parser.add_argument_group("内存统计与预算")
+    memory.add_argument('--budget', metavar='NAME=SIZE', action='append', default=[],
+                        help="子系统内存预算 (可重复)，超出时回收，如 history=50MB、log_text=2MB；"
+                             f"可用: {', '.join(MemoryAccountant.EVICTABLE)}")
+    memory.add_argument('--memory-report', action='store_true', help="命令行运行结束 (守护进程为每个周期) 后输出内存报告")
+    memory.add_argument('--trace-memory', action='store_true', help="启用 tracemalloc，报告中附带 Python 堆总量和主要分配位置")
+
+    benchmark = parser.add_argument_group("性能测试")
+    benchmark.add_argument('--benchmark-gui', action='store_true', help="在离屏 Qt 中测试不同查询规模下的界面卡顿")
+    benchmark.add_argument('--benchmark-sizes', default='10,100,1000', help="界面基准测试的查询站点数 (逗号分隔)")
+    benchmark.add_argument('--benchmark-storage', action='store_true',
+                           help="比较报文历史在原存储与紧凑存储下的每条报文字节数和访问耗时，并核对滚动统计的内存估算")
+    benchmark.add_argument('--storage-stations', type=int, default=5000, help="存储基准测试的站点数")
+    benchmark.add_argument('--verify-rolling', action='store_true',
+                           help="用随机报文序列把增量滚动统计与按窗口重新计算的结果逐站比较")
+    args = parser.parse_args(argv)
+    try:
+        args.budgets = MemoryAccountant.parse_budgets(args.budget)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.memory_report:
+        args.trace_memory = True
+    if args.export or (args.memory_report and not args.daemon):
+        args.headless = True
+    return args
+
+
+def make_source(args):
+    return MetarSource(args.source, clock=RemoteClock(args.source) if args.server_clock else None,
+                       mirrors=args.mirror)
+
+
+def run_stand_in_server(args):
+    start = datetime.fromisoformat(args.start).replace(tzinfo=pytz.utc) if args.start else None
+    server = StandInServer(args.serve, host='127.0.0.1', port=args.port,
+                           clock=SimulatedClock(start, speed=args.speed),
+                           latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, grow=args.grow)
+    log_to_console(f"替身服务器已启动: {server.base_url} (归档 {len(server.days)} 天，时钟 {args.speed:g} 倍速)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+def run_replay(args):
+    driver = ReplayDriver(args.replay, polls_per_hour=args.polls_per_hour, mirrors=args.replay_mirrors,
+                          log=log_to_console,
+                          latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, grow=args.grow)
+    driver.run()
+    return 0
+
+
+def synthetic_reports(count, seed=0):
+    """按站点表生成 count 条合成报文 (基准测试用)"""
+    rng = random.Random(seed)
+    stations = sorted(load_station_table())[:count]
+    weather = ['', '-RA', 'BR', 'FZRA', '+TSRA', '-SHRASN', 'FG', 'HZ', 'VCSH']
+    trends = ['NOSIG', 'BECMG TL0400 6000 BKN020', 'TEMPO 0300 -TSRA FEW030CB']
+    reports = []
+    for station in stations:
+        reports.append(' '.join(filter(None, [
+            station, '190300Z', f"{rng.randrange(0, 360, 10):03d}{rng.randint(0, 30):02d}KT",
+            rng.choice(['9999', '0800', '3000', 'CAVOK']), f"R{rng.randint(1, 36):02d}/{rng.randrange(200, 2000, 100):04d}",
+            rng.choice(weather), f"BKN0{rng.randint(0, 9)}0", f"{rng.randint(0, 30):02d}/{rng.randint(0, 9):02d}",
+            f"Q10{rng.randint(0, 30):02d}", rng.choice(trends)])))
+    return reports
+
+
+def run_responsiveness_benchmark(sizes=(10, 100, 1000), repeats=3, log=print):
+    """在离屏 Qt 中驱动 10/100/1000 站查询，报告每种规模下事件循环的最长卡顿"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = MetarApp(start_background=False, stall_threshold_ms=50)
+    window.show()
+    downloader = window.downloader
+    for line in synthetic_reports(max(sizes)):
+        downloader.metar_data[line.split()[0]] = line
+    downloader.derived = downloader.compute_derived()
+    downloader.spatial_index = StationIndex(load_station_table(), list(downloader.metar_data))
+    codes = list(downloader.metar_data)
+
+    def spin(ms):
+        loop = QEventLoop()
+        QTimer.singleShot(ms, loop.quit)
+        loop.exec()
+
+    def search_and_wait():
+        loop = QEventLoop()
+        window.search_finished.connect(loop.quit)
+        QTimer.singleShot(0, window.search_metar)
+        loop.exec()
+        window.search_finished.disconnect(loop.quit)
+        return window.first_result_at - window.search_started_at
+
+    results = []
+    for size in sizes:
+        spin(200)
+        window.watchdog.reset()
+        window.search_entry.setText(','.join(codes[:size]))
+        start = time.perf_counter()
+        first_result = sum(search_and_wait() for _ in range(repeats)) / repeats
+        elapsed = (time.perf_counter() - start) / repeats
+        summary = window.watchdog.summary()
+        worst = max(window.watchdog.stalls, key=lambda s: s[1], default=None)
+        summary.update(size=size, seconds_per_search=elapsed, seconds_to_first_result=first_result,
+                       culprit=EventLoopWatchdog.culprit(worst[2]) if worst and worst[2] else '')
+        results.append(summary)
+        log(f"{size:>5} 站: 最长卡顿 {summary['max_ms']:.1f} 毫秒，p99 {summary['p99_ms']:.1f} 毫秒，"
+            f"卡顿 {summary['stalls']} 次，首批结果 {first_result * 1000:.0f} 毫秒，单次查询 {elapsed * 1000:.0f} 毫秒"
+            + (f"，最严重卡顿位于 {summary['culprit']}" if summary['culprit'] else ''))
+    window.watchdog.stop()
+    window.close()
+    return results
+
+
+def run_storage_benchmark(stations=5000, hours=24, log=print):
+    """比较报文历史在原字典+字符串存储与 CompactReportStore 下每条报文的内存占用和访问耗时"""
+    base = datetime(2026, 1, 1, tzinfo=pytz.utc)
+
+    # 预先生成各小时报文的模板，测量时再拼出新的字符串，避免模板本身计入存储占用
+    templates = [[line.split(' ', 2)[::2] for line in synthetic_reports(stations, seed=hour)] for hour in range(hours)]
+
+    def hourly_reports():
+        for hour, parts in enumerate(templates):
+            moment = base + timedelta(hours=hour)
+            stamp = moment.strftime('%d%H%MZ')
+            reference = moment + timedelta(minutes=5)
+            for station, rest in parts:
+                yield station, f"{station} {stamp} {rest}", reference
+
+    def measure(build):
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+        if not was_tracing:
+            tracemalloc.stop()
+        return result, size
+
+    parser = METARParser()
+
+    def build_baseline():
+        # 原 ReportHistory 的布局: 站点 -> deque[(观测时间, 报文)]
+        reports = {}
+        for station, line, reference in hourly_reports():
+            reports.setdefault(station, deque()).append((parser.observation_time(line, reference), line))
+        return reports
+
+    def build_parsed():
+        sample = []
+        for i, (_, line, _) in enumerate(hourly_reports()):
+            if i >= 1000:
+                break
+            sample.append(parser.parse(line))
+        return sample
+
+    def build_compact():
+        history = ReportHistory(retention_hours=hours)
+        for station, line, reference in hourly_reports():
+            history.add(station, line, reference)
+        return history
+
+    baseline, baseline_bytes = measure(build_baseline)
+    count = sum(len(entries) for entries in baseline.values())
+    del baseline
+    sample, parsed_bytes = measure(build_parsed)
+    parsed_per_report = parsed_bytes / len(sample)
+    del sample
+    history, compact_bytes = measure(build_compact)
+    del history
+    # 写入耗时在 tracemalloc 之外单独测量
+    start = time.perf_counter()
+    history = build_compact()
+    ingest = time.perf_counter() - start
+    store = history.store
+
+    log(f"报文历史存储基准: {len(store.station_names)} 个站点 x {hours} 小时 = {count} 条报文")
+    log(f"  原存储 (字典 + deque + 字符串): {baseline_bytes / count:7.1f} 字节/条，共 {baseline_bytes / 2 ** 20:.1f} MB")
+    log(f"  解析后的字典 (抽样 {1000} 条):    {parsed_per_report:7.1f} 字节/条")
+    log(f"  紧凑存储:                       {compact_bytes / count:7.1f} 字节/条，共 {compact_bytes / 2 ** 20:.1f} MB，"
+        f"为原存储的 {compact_bytes / baseline_bytes:.1%} (估算 {history.nbytes / count:.1f} 字节/条)")
+
+    last_hour = ReportHistory.to_minute(base + timedelta(hours=hours - 1))
+    start = time.perf_counter()
+    scanned = sum(1 for _ in history.iter_range())
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = sum(1 for _ in store.records(last_hour))
+    records = time.perf_counter() - start
+    log(f"  写入 {ingest / count * 1e6:.1f} 微秒/条；全量扫描 {scanned} 条 {scan * 1000:.0f} 毫秒")
+    log(f"  最近 1 小时 {parsed} 条按需解析 {records * 1000:.0f} 毫秒")
+    del history, store
+
+    # 滚动统计: 派生参数表预先算好，只测量统计本身的占用，并核对 nbytes() 估算值
+    cycles = []
+    for hour, parts in enumerate(templates):
+        moment = base + timedelta(hours=hour)
+        stamp = moment.strftime('%d%H%MZ')
+        metar_data = {station: f"{station} {stamp} {rest}" for station, rest in parts}
+        cycles.append((metar_data, DerivedTable.compute(metar_data, parser, load_station_table()),
+                       moment + timedelta(minutes=5)))
+
+    def build_rolling():
+        rolling = RollingStatistics(window_hours=hours)
+        for metar_data, derived, reference in cycles:
+            rolling.ingest(list(metar_data), metar_data, derived, reference)
+        return rolling
+
+    rolling, rolling_bytes = measure(build_rolling)
+    estimate = rolling.nbytes()
+    log(f"  滚动统计 ({len(rolling)} 个站点 x {hours} 个样本): 实际 {rolling_bytes / len(rolling):.0f} 字节/站，"
+        f"估算 {estimate / len(rolling):.0f} 字节/站 (估算/实际 {estimate / rolling_bytes:.2f})")
+    return {
+        'reports': count, 'baseline_bytes': baseline_bytes / count, 'parsed_bytes': parsed_per_report,
+        'compact_bytes': compact_bytes / count, 'ingest_us': ingest / count * 1e6, 'scan_ms': scan * 1000,
+        'rolling_bytes': rolling_bytes / len(rolling), 'rolling_estimate': estimate / len(rolling),
+    }
+
+
+def run_rolling_verification(stations=60, steps=600, seed=0, log=print):
+    """用随机报文序列 (缺测、迟到、重复报文和提前淘汰) 驱动 RollingStatistics，
+    每一步都与按窗口内全部样本重新计算的结果逐站比较，返回不一致的次数"""
+    rng = random.Random(seed)
+    parser = METARParser()
+    station_table = load_station_table()
+    codes = sorted(station_table)[:stations]
+    rolling = RollingStatistics(window_hours=3)
+    samples = {}  # 站点 -> [(观测分钟, 温度, 最大风, 气压)]，只含被统计接受的样本
+    ifr_since = {}
+    ifr_hours = {}
+    base = datetime(2026, 1, 31, 18, 0, tzinfo=pytz.utc)  # 跨月，同时检验观测时间的推算
+    mismatches = checks = 0
+
+    def group(probability, text):
+        return text if rng.random() < probability else ''
+
+    for step in range(steps):
+        now = base + timedelta(minutes=10 * step)
+        changed = rng.sample(codes, rng.randint(0, len(codes)))
+        metar_data = {}
+        for station in changed:
+            observed = now - timedelta(minutes=rng.choice([0, 0, 0, 5, 25]))
+            temp = rng.randint(-3, 3)
+            metar_data[station] = ' '.join(filter(None, [
+                station, observed.strftime('%d%H%MZ'),
+                group(0.8, f"{rng.randrange(0, 360, 10):03d}{rng.randint(0, 5):02d}"
+                           f"{group(0.5, f'G{rng.randint(6, 8):02d}')}KT"),
+                rng.choice(['9999', '3000', '0800', '0300']), rng.choice(['', 'BKN004', 'OVC009', 'BKN030']),
+                group(0.8, f"{'M' if temp < 0 else ''}{abs(temp):02d}/M05"),
+                group(0.8, f"Q{rng.randint(1000, 1003)}")]))
+        derived = DerivedTable.compute(metar_data, parser, station_table)
+        rolling.ingest(changed, metar_data, derived, now)
+        # 参照实现：逐条追加被接受的样本
+        for station in changed:
+            i = derived.index[station]
+            minute = int(parser.observation_time(metar_data[station], now).timestamp() // 60)
+            window = samples.setdefault(station, [])
+            if window and minute <= window[-1][0]:
+                continue
+            gust = derived.wind_gust[i] if not math.isnan(derived.wind_gust[i]) else derived.wind_speed[i]
+            window.append((minute, *np.float32([derived.temp[i], gust, derived.qnh[i]]).tolist()))
+            category = int(derived.category[i])
+            if category in RollingStatistics.IFR_CATEGORIES:
+                ifr_since.setdefault(station, minute)
+            elif category:
+                ifr_since.pop(station, None)
+            ifr_hours[station] = (minute - ifr_since[station]) / 60 if station in ifr_since else 0.0
+
+        cutoff = math.ceil((now - rolling.window).timestamp() / 60)
+        rolling.expire(now)
+        if rng.random() < 0.1:  # 模拟内存预算提前淘汰
+            cutoff = max(cutoff, int(now.timestamp() // 60) - rng.randint(60, 180))
+            rolling.evict_before(cutoff)
+        for station in list(samples):
+            samples[station] = [sample for sample in samples[station] if sample[0] >= cutoff]
+            if not samples[station]:
+                del samples[station]
+                ifr_since.pop(station, None)
+                ifr_hours.pop(station, None)
+
+        columns = rolling.columns(codes)
+        for k, station in enumerate(codes):
+            window = samples.get(station, [])
+            expected = {}
+            for q, name in enumerate(RollingWindow.QUANTITIES):
+                values = [sample[q + 1] for sample in window if not math.isnan(sample[q + 1])]
+                expected[f'{name}_min'] = min(values) if values else math.nan
+                expected[f'{name}_max'] = max(values) if values else math.nan
+                expected[f'{name}_mean'] = sum(values) / len(values) if values else math.nan
+            qnh = [sample[3] for sample in window if not math.isnan(sample[3])]
+            expected['qnh_change'] = qnh[-1] - qnh[0] if qnh else math.nan
+            expected['ifr_hours'] = ifr_hours.get(station, math.nan)
+            for key, value in expected.items():
+                checks += 1
+                if not np.isclose(columns[key][k], value, equal_nan=True):
+                    mismatches += 1
+                    if mismatches <= 10:
+                        log(f"  不一致: 第 {step} 步 {station} {key} 增量 {columns[key][k]} / 重新计算 {value}")
+    log(f"滚动统计校验: {len(codes)} 个站点 x {steps} 步，比较 {checks} 个值，不一致 {mismatches} 个")
+    return mismatches
+
+
+def run_daemon(args):
+    downloader = DownloaderThread(make_source(args), args.archive, memory=MemoryAccountant(args.budgets))
+    try:
+        writer = SharedCacheWriter(args.shared_dir)
+    except OSError as e:
+        log_to_console(f"无法使用共享缓存目录: {e}")
+        return 1
+    downloader.log_signal.connect(log_to_console)
+
+    def publish(count):
+        if downloader.derived is None:
+            return
+        version, size = writer.publish(downloader.metar_data, downloader.derived, downloader.changed_stations,
+                                       downloader.history, downloader.now())
+        log_to_console(f"已发布共享缓存版本 {version}: {len(downloader.metar_data)} 个站点，"
+                       f"{size / 1024:.0f} KB，变化 {len(downloader.changed_stations)} 个站点。")
+        if args.memory_report:
+            log_to_console(downloader.memory.describe())
+
+    downloader.update_complete_signal.connect(publish)
+    log_to_console(f"共享缓存守护进程已启动，段文件目录: {args.shared_dir}")
+    try:
+        downloader.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_headless(args):
+    memory = MemoryAccountant(args.budgets)
+    if args.attach:
+        downloader = SharedCacheClient(args.shared_dir, memory=memory)
+        downloader.log_signal.connect(log_to_console)
+        if not downloader.poll():
+            log_to_console(f"没有可用的共享缓存: {args.shared_dir}")
+            return 1
+    else:
+        if args.export and args.since is not None:
+            # 单次运行只下载一个周期，没有可供导出的历史
+            log_to_console("--since 导出的是守护进程保存的报文历史，需与 --attach 一起使用")
+            return 1
+        downloader = DownloaderThread(make_source(args), args.archive, memory=memory)
+        downloader.log_signal.connect(log_to_console)
+        downloader.download_metar_file()
+    if args.export:
+        now = downloader.now()
+        if args.since is None:
+            reports = [(line, None) for line in downloader.metar_data.values()]
+        else:
+            reports = downloader.history.iter_range(now - timedelta(hours=args.since))
+        start = time.perf_counter()
+        exporter = ReportExporter(chunk_size=args.chunk_size)
+        count = exporter.export(reports, args.export, args.format, reference=now,
+                                progress=lambda n: log_to_console(f"已导出 {n} 条报文..."))
+        log_to_console(f"导出完成: {count} 条报文写入 {args.export}，耗时 {time.perf_counter() - start:.2f} 秒。")
+    if args.memory_report:
+        log_to_console(memory.describe(memory.report(top=10)))
+    return 0
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    if args.trace_memory:
+        tracemalloc.start()
+    if args.serve:
+        sys.exit(run_stand_in_server(args))
+    if args.replay:
+        sys.exit(run_replay(args))
+    if args.benchmark_gui:
+        sizes = [int(n) for n in args.benchmark_sizes.split(',')]
+        run_responsiveness_benchmark(sizes, log=log_to_console)
+        sys.exit(0)
+    if args.benchmark_storage:
+        run_storage_benchmark(args.storage_stations, log=log_to_console)
+        sys.exit(0)
+    if args.verify_rolling:
+        sys.exit(1 if run_rolling_verification(log=log_to_console) else 0)
+    if args.daemon:
+        sys.exit(run_daemon(args))
+    if args.headless:
+        sys.exit(run_headless(args))
     try:
         app = QApplication(sys.argv)
-        window = MetarApp()
+        window = MetarApp(make_source(args), args.archive, attach_dir=args.shared_dir if args.attach else None,
+                          budgets=args.budgets)
         window.show()
         sys.exit(app.exec())
     except Exception as e: